@@ -0,0 +1,413 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2014 Richard Moore
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+# Benchmarks for the key derivation, AES-CTR and ScryptFile throughput, and
+# the time taken to import pyscrypt.
+#
+#   python benchmarks/run-benchmarks.py run [--output results.json] [options]
+#   python benchmarks/run-benchmarks.py compare baseline.json results.json [--threshold 0.1]
+#
+# Each benchmark reports the best of several timed runs and the peak memory
+# (RSS above the starting RSS, sampled while it runs; or the tracemalloc
+# peak with --tracemalloc, which is far slower). compare exits with status 1
+# if any benchmark got slower than the baseline by more than the threshold.
+
+import sys
+sys.path += '..'
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import threading
+import time
+
+import pyscrypt
+from pyscrypt import ScryptFile, aesctr
+
+
+# Each benchmark is repeated until it has run for at least this long
+MIN_SECONDS = 0.5
+
+# ...but at most this many times
+MAX_REPEAT = 5
+
+# How often the RSS is sampled
+SAMPLE_INTERVAL = 0.005
+
+# The default grids
+HASH_N = [ 256, 1024, 4096 ]
+HASH_R = [ 1, 8 ]
+HASH_P = [ 1, 4 ]
+AES_CHUNKS = [ 16, 256, 4096, 65536 ]
+AES_BYTES = 64 * 1024
+AES_WORKERS = [ 2, 4 ]
+FILE_SIZES = [ '1K', '16K', '256K' ]
+IMPORT_RUNS = 5
+
+
+def parse_size(size):
+    'Returns the number of bytes for a size like 1024, 16K, 1M or 1G.'
+
+    units = dict(K = 1024, M = 1024 * 1024, G = 1024 * 1024 * 1024)
+    size = size.strip().upper()
+    if size[-1:] in units:
+        return int(size[:-1]) * units[size[-1]]
+    return int(size)
+
+
+def rss():
+    'Returns the resident set size of this process in bytes, or None if unknown.'
+
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        return None
+
+
+class PeakMemory(object):
+    'Context manager measuring the peak memory used by its body (in bytes).'
+
+    def __init__(self, use_tracemalloc = False):
+        self._tracemalloc = use_tracemalloc
+        self.peak = None
+
+    def _sample(self):
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            self._max = max(self._max, rss())
+
+    def __enter__(self):
+        if self._tracemalloc:
+            import tracemalloc
+            tracemalloc.start()
+            return self
+
+        self._start = rss()
+        if self._start is not None:
+            self._max = self._start
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target = self._sample)
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._tracemalloc:
+            import tracemalloc
+            self.peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        elif self._start is not None:
+            self._stop.set()
+            self._thread.join()
+            self.peak = max(self._max, rss()) - self._start
+
+
+def measure(function, use_tracemalloc = False):
+    '''Returns (best seconds, runs, peak memory) for calling function
+       repeatedly. The memory is measured over the first run only.'''
+
+    with PeakMemory(use_tracemalloc) as memory:
+        start = time.time()
+        function()
+        best = time.time() - start
+
+    # tracemalloc slows everything down; time the runs without it
+    if use_tracemalloc:
+        start = time.time()
+        function()
+        best = time.time() - start
+
+    runs = 1
+    total = best
+    while total < MIN_SECONDS and runs < MAX_REPEAT:
+        start = time.time()
+        function()
+        elapsed = time.time() - start
+        best = min(best, elapsed)
+        total += elapsed
+        runs += 1
+
+    return (best, runs, memory.peak)
+
+
+def result(name, params, measurement, work = None, unit = None):
+    'Returns a result record; work / seconds is reported as the throughput.'
+
+    (seconds, runs, peak) = measurement
+    record = dict(name = name, params = params, seconds = seconds, runs = runs, peak_memory = peak)
+    if work is not None:
+        record['throughput'] = work / seconds
+        record['unit'] = unit
+
+    print("%-50s %10.4fs %14s %12s" % (name, seconds,
+                                      '' if work is None else ('%.3f %s' % (work / seconds, unit)),
+                                      '-' if peak is None else ('%d KiB' % (peak // 1024))))
+    sys.stdout.flush()
+
+    return record
+
+
+def bench_hash(args):
+    'Times pyscrypt.hash across the grid of N, r and p for each backend.'
+
+    results = [ ]
+    for backend in args.backends:
+        for N in args.N:
+            for r in args.r:
+                for p in args.p:
+                    function = lambda: pyscrypt.hash(b'password', b'salt', N, r, p, 64, backend = backend)
+                    name = 'hash backend=%s N=%d r=%d p=%d' % (backend, N, r, p)
+                    params = dict(backend = backend, N = N, r = r, p = p)
+                    results.append(result(name, params, measure(function, args.tracemalloc), 1, 'hash/s'))
+    return results
+
+
+def bench_aes(args):
+    '''Times AESCounterModeOfOperation's bulk keystream generation, and
+       encrypt in chunks of each size.'''
+
+    results = [ ]
+    plaintext = os.urandom(args.aes_bytes)
+
+    # With each AES engine (the numpy engine takes long runs of blocks)
+    engines = [ ('python', None) ]
+    if aesctr._load_numpy_engine() is not None:
+        engines.append(('numpy', aesctr.NUMPY_MIN_BLOCKS))
+    numpy_min_blocks = aesctr.NUMPY_MIN_BLOCKS
+    for (engine, min_blocks) in engines:
+        aesctr.NUMPY_MIN_BLOCKS = min_blocks if min_blocks is not None else len(plaintext)
+        function = lambda: aesctr.AESCounterModeOfOperation(key = b'\0' * 32).keystream(len(plaintext) // 16)
+        params = dict(engine = engine, bytes = len(plaintext))
+        results.append(result('aes-ctr keystream engine=%s' % engine, params, measure(function, args.tracemalloc), len(plaintext) / 1e6, 'MB/s'))
+    aesctr.NUMPY_MIN_BLOCKS = numpy_min_blocks
+
+    # Split across worker processes (shared memory needs Python 3.8+)
+    if sys.version_info >= (3, 8):
+        for workers in args.aes_workers:
+            function = lambda: aesctr.crypt_parallel(b'\0' * 32, plaintext, 0, workers)
+            name = 'aes-ctr parallel workers=%d' % workers
+            params = dict(workers = workers, bytes = len(plaintext))
+            results.append(result(name, params, measure(function, args.tracemalloc), len(plaintext) / 1e6, 'MB/s'))
+
+    for chunk in args.aes_chunks:
+        def function():
+            aes = aesctr.AESCounterModeOfOperation(key = b'\0' * 32)
+            for offset in range(0, len(plaintext), chunk):
+                aes.encrypt(plaintext[offset:offset + chunk])
+
+        name = 'aes-ctr chunk=%d' % chunk
+        params = dict(chunk = chunk, bytes = len(plaintext))
+        results.append(result(name, params, measure(function, args.tracemalloc), len(plaintext) / 1e6, 'MB/s'))
+    return results
+
+
+def bench_file(args):
+    '''Times writing, reading (in blocks and by line) and verifying
+       ScryptFiles of each size; the key derivation uses a tiny N so the
+       encryption dominates.'''
+
+    results = [ ]
+    directory = tempfile.mkdtemp(prefix = 'pyscrypt-bench-')
+    try:
+        for size in args.file_sizes:
+            length = parse_size(size)
+            path = os.path.join(directory, 'bench-%d.scrypt' % length)
+
+            # Short lines, so readline has work to do
+            line = b'The quick brown fox jumps over the lazy dog 0123456789\n'
+            plaintext = (line * (length // len(line) + 1))[:length]
+
+            def write():
+                with ScryptFile(path, b'password', N = 16, r = 1, p = 1) as sf:
+                    for offset in range(0, length, 65536):
+                        sf.write(plaintext[offset:offset + 65536])
+
+            def read():
+                with ScryptFile(path, b'password') as sf:
+                    remaining = length
+                    while remaining > 0:
+                        remaining -= len(sf.read(65536))
+
+            def readline():
+                with ScryptFile(path, b'password') as sf:
+                    while sf.readline():
+                        pass
+
+            def verify():
+                with open(path, 'rb') as f:
+                    if not ScryptFile.verify_file(f, b'password'):
+                        raise Exception('benchmark file failed to verify')
+
+            for (operation, function) in (('write', write), ('read', read), ('readline', readline), ('verify', verify)):
+                name = 'file %s size=%s' % (operation, size)
+                params = dict(operation = operation, size = length)
+                results.append(result(name, params, measure(function, args.tracemalloc), length / 1e6, 'MB/s'))
+
+    finally:
+        for filename in os.listdir(directory):
+            os.unlink(os.path.join(directory, filename))
+        os.rmdir(directory)
+
+    return results
+
+
+def import_time(statement):
+    '''Returns the cumulative seconds python -X importtime reports for
+       importing pyscrypt in a new interpreter running statement.'''
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    environ = dict(os.environ)
+    environ['PYTHONPATH'] = os.pathsep.join([ root ] + [ p for p in [ environ.get('PYTHONPATH') ] if p ])
+
+    process = subprocess.Popen([ sys.executable, '-X', 'importtime', '-c', statement ], env = environ,
+                               stdout = subprocess.PIPE, stderr = subprocess.PIPE, universal_newlines = True)
+    (stdout, stderr) = process.communicate()
+    if process.returncode != 0:
+        raise Exception('import failed: %s' % stderr)
+
+    # Lines are "import time: self [us] | cumulative | imported package",
+    # the package indented by its depth; add up the top-level pyscrypt ones
+    seconds = 0
+    for line in stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) != 3 or fields[2].startswith('  '):
+            continue
+        name = fields[2].strip()
+        if name == 'pyscrypt' or name.startswith('pyscrypt.'):
+            seconds += int(fields[1]) / 1e6
+    return seconds
+
+
+def bench_import(args):
+    '''Times importing pyscrypt, alone and with the file format, with python
+       -X importtime (Python 3.7+); the best of args.import_runs fresh
+       interpreters.'''
+
+    results = [ ]
+    if sys.version_info < (3, 7):
+        return results
+
+    for (name, statement) in (('import pyscrypt', 'import pyscrypt'),
+                              ('import pyscrypt + ScryptFile', 'import pyscrypt; pyscrypt.ScryptFile')):
+        times = [ import_time(statement) for i in range(0, args.import_runs) ]
+        params = dict(statement = statement)
+        results.append(result(name, params, (min(times), len(times), None)))
+    return results
+
+
+SUITES = dict(hash = bench_hash, aes = bench_aes, file = bench_file, startup = bench_import)
+
+
+def run(args):
+    results = [ ]
+    for suite in args.suites:
+        results.extend(SUITES[suite](args))
+
+    report = dict(
+        version = ".".join(str(p) for p in pyscrypt.VERSION),
+        python = platform.python_version(),
+        implementation = platform.python_implementation(),
+        platform = platform.platform(),
+        time = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        results = results,
+    )
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent = 2, sort_keys = True)
+        print("Results written to %s" % args.output)
+
+    return 0
+
+
+def compare(args):
+    '''Compares the results against the baseline; a benchmark has regressed
+       if it takes more than threshold (a fraction) longer.'''
+
+    with open(args.baseline) as f:
+        baseline = dict((r['name'], r) for r in json.load(f)['results'])
+    with open(args.results) as f:
+        results = json.load(f)['results']
+
+    regressions = 0
+    print("%-50s %10s %10s %8s" % ('benchmark', 'baseline', 'current', 'change'))
+    for record in results:
+        base = baseline.get(record['name'])
+        if base is None:
+            print("%-50s %10s %9.4fs %8s" % (record['name'], '-', record['seconds'], 'new'))
+            continue
+
+        change = record['seconds'] / base['seconds'] - 1
+        flag = ''
+        if change > args.threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+
+        print("%-50s %9.4fs %9.4fs %+7.1f%%%s" % (record['name'], base['seconds'], record['seconds'], 100 * change, flag))
+
+    print("")
+    print("%d regression(s) beyond %.0f%%" % (regressions, 100 * args.threshold))
+
+    return 1 if regressions else 0
+
+
+def main(arguments):
+    parser = argparse.ArgumentParser(prog = 'run-benchmarks.py', description = 'pyscrypt benchmarks')
+    commands = parser.add_subparsers(dest = 'command')
+
+    parser_run = commands.add_parser('run', help = 'run the benchmarks')
+    parser_run.add_argument('--output', '-o', help = 'write the results as JSON to this file')
+    parser_run.add_argument('--suites', nargs = '+', choices = sorted(SUITES), default = [ 'hash', 'aes', 'file', 'startup' ])
+    parser_run.add_argument('--backends', nargs = '+', default = pyscrypt.available_backends(), help = 'key derivation backends')
+    parser_run.add_argument('-N', nargs = '+', type = int, default = HASH_N)
+    parser_run.add_argument('-r', nargs = '+', type = int, default = HASH_R)
+    parser_run.add_argument('-p', nargs = '+', type = int, default = HASH_P)
+    parser_run.add_argument('--aes-chunks', nargs = '+', type = int, default = AES_CHUNKS, help = 'encrypt chunk sizes in bytes')
+    parser_run.add_argument('--aes-workers', nargs = '+', type = int, default = AES_WORKERS, help = 'worker processes for the parallel AES-CTR')
+    parser_run.add_argument('--aes-bytes', type = parse_size, default = AES_BYTES, help = 'bytes encrypted per chunk size')
+    parser_run.add_argument('--file-sizes', nargs = '+', default = FILE_SIZES, help = 'ScryptFile sizes (e.g. 1K 1M 1G)')
+    parser_run.add_argument('--import-runs', type = int, default = IMPORT_RUNS, help = 'interpreters started to time the import')
+    parser_run.add_argument('--tracemalloc', action = 'store_true', help = 'measure peak memory with tracemalloc instead of RSS')
+
+    parser_compare = commands.add_parser('compare', help = 'compare results against a baseline')
+    parser_compare.add_argument('baseline')
+    parser_compare.add_argument('results')
+    parser_compare.add_argument('--threshold', type = float, default = 0.1, help = 'allowed slowdown as a fraction (default: 0.1)')
+
+    args = parser.parse_args(arguments)
+
+    if args.command == 'run':
+        return run(args)
+    elif args.command == 'compare':
+        return compare(args)
+
+    parser.print_help()
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
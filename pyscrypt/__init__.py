@@ -32,9 +32,39 @@
 # This implementation is VERY slow; It is meant only for reference and
 # for situations where C wrappers are not permitted or difficult to install.
 
-from .file import InvalidScryptFileFormat, ScryptFile
-from .hash import hash
+import sys
+
+from .arena import release_buffers, set_arena
+from .backend import available_backends, register_backend
+from .cache import DerivedKeyCache
+from .calibrate import calibrate
+from .hash import available_engines, derive, hash, hash_many, set_executor
+from .hasher import ScryptCancelled, ScryptHasher
+from .mining import scan_nonces
+
+# The file format (and the AES-CTR it needs) is imported on first use, so
+# callers which only hash do not pay for it; module __getattr__ (PEP 562)
+# needs Python 3.7
+_lazy = dict(InvalidScryptFileFormat = 'file', ScryptFile = 'file')
+
+if sys.version_info >= (3, 7):
+    import importlib
+
+    def __getattr__(name):
+        module = _lazy.get(name)
+        if module is None:
+            raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+        value = getattr(importlib.import_module('.' + module, __name__), name)
+        globals()[name] = value
+        return value
+
+    def __dir__():
+        return sorted(set(globals()) | set(_lazy))
+
+else:
+    from .file import InvalidScryptFileFormat, ScryptFile
 
 VERSION = [1, 6, 2]
 
-__all__ = ['hash', 'InvalidScryptFileFormat', 'ScryptFile']
+__all__ = ['available_backends', 'available_engines', 'calibrate', 'derive', 'DerivedKeyCache', 'register_backend', 'release_buffers', 'hash', 'hash_many', 'scan_nonces', 'set_arena', 'set_executor', 'ScryptCancelled', 'ScryptHasher', 'InvalidScryptFileFormat', 'ScryptFile']
@@ -0,0 +1,106 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2014 Richard Moore
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+# NumPy AES engine; an optional drop-in for the CTR keystream in aesctr.py.
+#
+# Every counter block of a run is encrypted at the same time; the state is
+# four uint32 arrays (one per column, a row for each block), each round is
+# four table gathers per column into T1 - T4, and the last round gathers
+# from the S-box.
+
+import numpy
+
+from .aesctr import AES
+
+
+# The tables, as uint32 arrays
+T1 = numpy.array(AES.T1, dtype = numpy.uint32)
+T2 = numpy.array(AES.T2, dtype = numpy.uint32)
+T3 = numpy.array(AES.T3, dtype = numpy.uint32)
+T4 = numpy.array(AES.T4, dtype = numpy.uint32)
+S = numpy.array(AES.S, dtype = numpy.uint32)
+
+_MASK = 0xffffffff
+
+# Blocks encrypted per batch, which bounds the temporary arrays
+BATCH_BLOCKS = 16384
+
+
+def round_keys(aes):
+    'Returns the round keys of an AES instance as a (rounds + 1, 4) uint32 array.'
+
+    return numpy.array([ [ k & _MASK for k in ks ] for ks in aes._Ke ], dtype = numpy.uint32)
+
+
+def counter_words(counter, blocks):
+    '''Returns the four (big-endian) words of counter through counter +
+       blocks - 1, as four uint32 arrays; the caller ensures they do not
+       exceed 128 bits.'''
+
+    low = numpy.uint64(counter & 0xffffffffffffffff) + numpy.arange(blocks, dtype = numpy.uint64)
+
+    # Carry into the high 64 bits where the low 64 bits wrapped
+    high = numpy.uint64(counter >> 64) + (low < numpy.uint64(counter & 0xffffffffffffffff)).astype(numpy.uint64)
+
+    return ((high >> numpy.uint64(32)).astype(numpy.uint32), (high & numpy.uint64(_MASK)).astype(numpy.uint32),
+            (low >> numpy.uint64(32)).astype(numpy.uint32), (low & numpy.uint64(_MASK)).astype(numpy.uint32))
+
+
+def encrypt_columns(Ke, t0, t1, t2, t3):
+    '''Encrypts every block at once; t0 - t3 are the uint32 arrays of each
+       block's four words and Ke the round keys (see round_keys). Returns the
+       result as a (blocks, 4) uint32 array.'''
+
+    (t0, t1, t2, t3) = (t0 ^ Ke[0, 0], t1 ^ Ke[0, 1], t2 ^ Ke[0, 2], t3 ^ Ke[0, 3])
+
+    # Apply round transforms
+    for k in Ke[1:-1]:
+        (t0, t1, t2, t3) = (
+            T1[t0 >> 24] ^ T2[(t1 >> 16) & 0xFF] ^ T3[(t2 >> 8) & 0xFF] ^ T4[t3 & 0xFF] ^ k[0],
+            T1[t1 >> 24] ^ T2[(t2 >> 16) & 0xFF] ^ T3[(t3 >> 8) & 0xFF] ^ T4[t0 & 0xFF] ^ k[1],
+            T1[t2 >> 24] ^ T2[(t3 >> 16) & 0xFF] ^ T3[(t0 >> 8) & 0xFF] ^ T4[t1 & 0xFF] ^ k[2],
+            T1[t3 >> 24] ^ T2[(t0 >> 16) & 0xFF] ^ T3[(t1 >> 8) & 0xFF] ^ T4[t2 & 0xFF] ^ k[3])
+
+    # The last round is special
+    k = Ke[-1]
+    output = numpy.empty((len(t0), 4), dtype = numpy.uint32)
+    output[:, 0] = ((S[t0 >> 24] << 24) | (S[(t1 >> 16) & 0xFF] << 16) | (S[(t2 >> 8) & 0xFF] << 8) | S[t3 & 0xFF]) ^ k[0]
+    output[:, 1] = ((S[t1 >> 24] << 24) | (S[(t2 >> 16) & 0xFF] << 16) | (S[(t3 >> 8) & 0xFF] << 8) | S[t0 & 0xFF]) ^ k[1]
+    output[:, 2] = ((S[t2 >> 24] << 24) | (S[(t3 >> 16) & 0xFF] << 16) | (S[(t0 >> 8) & 0xFF] << 8) | S[t1 & 0xFF]) ^ k[2]
+    output[:, 3] = ((S[t3 >> 24] << 24) | (S[(t0 >> 16) & 0xFF] << 16) | (S[(t1 >> 8) & 0xFF] << 8) | S[t2 & 0xFF]) ^ k[3]
+
+    return output
+
+
+def keystream(aes, counter, blocks):
+    '''Returns the CTR keystream of blocks blocks from counter for an AES
+       instance, as a bytearray.'''
+
+    Ke = round_keys(aes)
+    output = bytearray(16 * blocks)
+    for start in range(0, blocks, BATCH_BLOCKS):
+        count = min(BATCH_BLOCKS, blocks - start)
+        encrypted = encrypt_columns(Ke, *counter_words(counter + start, count))
+        output[16 * start:16 * (start + count)] = encrypted.astype('>u4').tobytes()
+
+    return output
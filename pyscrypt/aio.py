@@ -0,0 +1,221 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2014 Richard Moore
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+# asyncio API (Python 3.7+); key derivations run on an executor so they do
+# not stall the event loop.
+#
+# A Limiter caps how many derivations run at once; further requests wait
+# their turn, and once max_queue requests are waiting, new requests fail
+# immediately with ScryptOverloaded (so a burst of logins cannot start
+# hundreds of memory-hungry derivations at once).
+#
+#    import pyscrypt.aio
+#
+#    pyscrypt.aio.configure(max_concurrency = 4, max_queue = 100)
+#    key = await pyscrypt.aio.hash(password, salt, N, r, p, dkLen)
+
+import asyncio
+import functools
+import os
+import weakref
+
+from .file import ScryptFile
+from .hash import check_parameters, derive as _derive
+
+
+__all__ = ['configure', 'derive', 'derive_file_key', 'hash', 'Limiter', 'open_file', 'ScryptOverloaded']
+
+
+class ScryptOverloaded(Exception): pass
+
+
+class _LoopState(object):
+    'A Limiter\'s semaphore and counters for one event loop.'
+
+    def __init__(self, max_concurrency):
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.running = 0
+        self.waiting = 0
+
+
+class Limiter(object):
+    '''Runs functions on an executor, at most max_concurrency at a time.
+
+       Up to max_queue further calls wait for a turn (None for no limit);
+       beyond that, calls raise ScryptOverloaded immediately. executor is a
+       concurrent.futures executor (None uses the event loop's default).
+       The limits apply separately to each event loop.'''
+
+    def __init__(self, max_concurrency = 4, max_queue = 64, executor = None):
+        if max_concurrency < 1:
+            raise ValueError('max_concurrency must be at least 1')
+
+        self._max_concurrency = max_concurrency
+        self._max_queue = max_queue
+        self._executor = executor
+
+        self._states = weakref.WeakKeyDictionary()
+
+    max_concurrency = property(lambda s: s._max_concurrency)
+    max_queue = property(lambda s: s._max_queue)
+    executor = property(lambda s: s._executor)
+
+    def _state(self):
+        loop = asyncio.get_running_loop()
+        state = self._states.get(loop)
+        if state is None:
+            state = self._states[loop] = _LoopState(self._max_concurrency)
+        return state
+
+    @property
+    def running(self):
+        'The number of calls running on the current event loop.'
+        return self._state().running
+
+    @property
+    def waiting(self):
+        'The number of calls waiting for a turn on the current event loop.'
+        return self._state().waiting
+
+    async def run(self, function, *args, **kwargs):
+        'Returns the result of function(*args, **kwargs), computed on the executor.'
+
+        state = self._state()
+
+        # Full; fail fast rather than joining the queue
+        if state.running >= self._max_concurrency and self._max_queue is not None and state.waiting >= self._max_queue:
+            raise ScryptOverloaded('too many key derivations queued (%d)' % state.waiting)
+
+        state.waiting += 1
+        try:
+            await state.semaphore.acquire()
+        finally:
+            state.waiting -= 1
+
+        loop = asyncio.get_running_loop()
+        try:
+            work = loop.run_in_executor(self._executor, functools.partial(function, *args, **kwargs))
+        except BaseException:
+            state.semaphore.release()
+            raise
+        state.running += 1
+
+        # The executor cannot stop work once it has started, so the turn
+        # ends when the work does, not when the caller stops waiting for it
+        # (e.g. cancelled by a timeout)
+        def finished(work):
+            state.running -= 1
+            state.semaphore.release()
+
+            # Nobody may be waiting for the result any more
+            if not work.cancelled():
+                work.exception()
+
+        work.add_done_callback(finished)
+
+        return await asyncio.shield(work)
+
+
+# The Limiter used when none is given
+_default_limiter = Limiter()
+
+
+def configure(max_concurrency = 4, max_queue = 64, executor = None):
+    'Replaces the default Limiter; see Limiter for the parameters.'
+
+    global _default_limiter
+    _default_limiter = Limiter(max_concurrency, max_queue, executor)
+    return _default_limiter
+
+
+def get_limiter():
+    'Returns the default Limiter.'
+
+    return _default_limiter
+
+
+async def derive(password, salt, N, r, p, dkLen, backend = None, cache = None, limiter = None):
+    '''Returns (key, backend_name) like pyscrypt.derive, computing the key on
+       the limiter's executor. The cache (if any) is consulted on the event
+       loop, so cached keys are returned without queuing.'''
+
+    check_parameters(password, salt, N)
+
+    if cache is not None:
+        key = cache.get(password, salt, N, r, p, dkLen)
+        if key is not None:
+            return (key, 'cache')
+
+    if limiter is None:
+        limiter = _default_limiter
+
+    (key, name) = await limiter.run(_derive, password, salt, N, r, p, dkLen, backend)
+
+    if cache is not None:
+        cache.put(password, salt, N, r, p, dkLen, key)
+
+    return (key, name)
+
+
+async def hash(password, salt, N, r, p, dkLen, backend = None, cache = None, limiter = None):
+    'Returns the scrypt derived key like pyscrypt.hash, without blocking the event loop.'
+
+    return (await derive(password, salt, N, r, p, dkLen, backend, cache, limiter))[0]
+
+
+async def derive_file_key(password, salt, N, r, p, backend = None, cache = None, limiter = None):
+    '''Returns the 64 byte ScryptFile key for the parameters (which may be
+       passed to ScryptFile as key, along with the same salt).'''
+
+    return (await derive(password, salt, N, r, p, 64, backend, cache, limiter))[0]
+
+
+async def open_file(fp, password, N = None, r = None, p = None, salt = None, mode = None, backend = None, cache = None, limiter = None):
+    '''Returns a ScryptFile whose key was derived off the event loop.
+
+       When writing, the key is derived before the file is opened or
+       written to. When reading, the parameters come from the header, so the
+       header is read and the key derived together on the executor.'''
+
+    # The same mode detection as ScryptFile
+    if mode is None:
+        if hasattr(fp, 'mode'):
+            mode = fp.mode
+        elif N is not None or r is not None or p is not None or salt is not None:
+            mode = ScryptFile.MODE_WRITE
+        else:
+            mode = ScryptFile.MODE_READ
+
+    if mode in ('w', 'wb'):
+        if N is None or r is None or p is None:
+            raise ValueError('Must specify N, r and p for file open for writing')
+        if salt is None:
+            salt = os.urandom(32)
+        key = await derive_file_key(password, salt, N, r, p, backend, cache, limiter)
+        return ScryptFile(fp, password, N, r, p, salt, mode, key = key)
+
+    sf = ScryptFile(fp, password, mode = mode, backend = backend, cache = cache)
+    if limiter is None:
+        limiter = _default_limiter
+    await limiter.run(sf._read_header)
+    return sf
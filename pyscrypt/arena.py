@@ -0,0 +1,178 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2014 Richard Moore
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+# An opt-in, per-thread arena of the pure-Python engine's V and XY buffers,
+# so a service hashing with the same N and r all day reuses them rather than
+# allocating (and freeing) 128 * r * N bytes for every hash.
+#
+#    pyscrypt.set_arena(max_bytes = 64 * 1024 * 1024)
+#    ... hash as usual ...
+#    pyscrypt.release_buffers()
+#
+# Each thread keeps its own buffers, keyed by (N, r), and releases the least
+# recently used once it holds more than max_bytes. Buffers are zeroed when
+# they are returned to the arena.
+
+import array
+import collections
+import threading
+import weakref
+
+
+# The default limit on the bytes each thread retains
+ARENA_MAX_BYTES = 64 * 1024 * 1024
+
+# Words zeroed at a time when a buffer is returned
+_ZERO_WORDS = 16384
+
+
+# The per-thread byte limit; None while the arena is disabled
+_max_bytes = None
+
+_local = threading.local()
+
+# Every thread's arena, so release_buffers can reach them all
+_arenas = weakref.WeakSet()
+_lock = threading.Lock()
+
+_zeros = { }
+
+
+class _Arena(object):
+    'One thread\'s buffers; (N, r) => (V, XY), least recently used first.'
+
+    def __init__(self):
+        self.buffers = collections.OrderedDict()
+        self.bytes = 0
+
+
+def _thread_arena():
+    arena = getattr(_local, 'arena', None)
+    if arena is None:
+        arena = _local.arena = _Arena()
+        with _lock:
+            _arenas.add(arena)
+    return arena
+
+
+def _size(V, XY):
+    return (len(V) + len(XY)) * V.itemsize
+
+
+def _zero(buffer):
+    'Overwrites an array with zeros, in place.'
+
+    zeros = _zeros.get(buffer.typecode)
+    if zeros is None:
+        zeros = _zeros[buffer.typecode] = array.array(buffer.typecode, [ 0 ]) * _ZERO_WORDS
+
+    for offset in range(0, len(buffer), _ZERO_WORDS):
+        length = min(_ZERO_WORDS, len(buffer) - offset)
+        buffer[offset:offset + length] = zeros[:length] if length < _ZERO_WORDS else zeros
+
+
+def set_arena(max_bytes = ARENA_MAX_BYTES):
+    '''Enables the buffer arena, retaining at most max_bytes per thread; None
+       (or 0) disables it and releases every buffer.'''
+
+    global _max_bytes
+
+    _max_bytes = max_bytes or None
+    if _max_bytes is None:
+        release_buffers()
+    else:
+        with _lock:
+            for arena in list(_arenas):
+                _trim(arena)
+
+
+def get_arena():
+    'Returns the per-thread byte limit, or None if the arena is disabled.'
+
+    return _max_bytes
+
+
+def acquire(N, r, typecode):
+    '''Returns (V, XY) buffers of typecode words for N and r; from this
+       thread's arena if it has them, otherwise newly allocated.'''
+
+    if _max_bytes is not None:
+        arena = _thread_arena()
+        with _lock:
+            buffers = arena.buffers.pop((N, r, typecode), None)
+            if buffers is not None:
+                arena.bytes -= _size(*buffers)
+                return buffers
+
+    V = array.array(typecode, [ 0 ]) * (32 * r * N)
+    XY = array.array(typecode, [ 0 ]) * (64 * r)
+
+    return (V, XY)
+
+
+def give_back(N, r, V, XY):
+    '''Zeros the buffers and returns them to this thread's arena (if it is
+       enabled and they fit).'''
+
+    if _max_bytes is None:
+        return
+
+    size = _size(V, XY)
+    if size > _max_bytes:
+        return
+
+    _zero(V)
+    _zero(XY)
+
+    arena = _thread_arena()
+    key = (N, r, V.typecode)
+    with _lock:
+        if key in arena.buffers:
+            return
+        arena.buffers[key] = (V, XY)
+        arena.bytes += size
+        _trim(arena)
+
+
+def _trim(arena):
+    'Releases the least recently used buffers over the limit. The lock must be held.'
+
+    while arena.buffers and (_max_bytes is None or arena.bytes > _max_bytes):
+        (key, buffers) = arena.buffers.popitem(last = False)
+        arena.bytes -= _size(*buffers)
+
+
+def release_buffers():
+    'Releases every buffer retained by the arena, in every thread.'
+
+    with _lock:
+        for arena in list(_arenas):
+            arena.buffers.clear()
+            arena.bytes = 0
+
+
+def retained_bytes():
+    'Returns the total bytes of buffers retained by the arena, across threads.'
+
+    with _lock:
+        return sum(arena.bytes for arena in _arenas)
@@ -0,0 +1,143 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2014 Richard Moore
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+# Registry of scrypt key derivation backends.
+#
+# Each backend is a function(password, salt, N, r, p, dkLen) returning the
+# derived key, along with a priority (higher is faster) and an optional
+# supports(N, r, p, dkLen) function for backends which cannot compute every
+# set of parameters. The pure-Python implementation (registered by hash.py)
+# can compute anything; hashlib.scrypt (OpenSSL) is used when present.
+#
+# The backend may be forced with the PYSCRYPT_BACKEND environment variable
+# (read at import time) or the backend argument to pyscrypt.hash/derive.
+
+import hashlib
+import os
+
+
+# Environment variable used to force a backend
+ENVIRONMENT_VARIABLE = 'PYSCRYPT_BACKEND'
+
+# hashlib.scrypt rejects a maxmem larger than a C int
+HASHLIB_MAX_MEMORY = (2 ** 31) - 1
+
+
+class Backend(object):
+
+    def __init__(self, name, function, priority, supports):
+        self.name = name
+        self.function = function
+        self.priority = priority
+        self.supports = supports
+
+    def __repr__(self):
+        return '<Backend %s priority=%d>' % (self.name, self.priority)
+
+
+# Registered backends, by name
+_backends = { }
+
+# The backend forced by the environment (if any)
+_forced = os.environ.get(ENVIRONMENT_VARIABLE) or None
+
+
+def register_backend(name, function, priority = 0, supports = None):
+    '''Registers (or replaces) a key derivation backend.
+
+       function(password, salt, N, r, p, dkLen) must return the derived key
+       and supports(N, r, p, dkLen), if given, whether it can compute those
+       parameters. When no backend is forced, the highest priority backend
+       that supports the parameters is used.'''
+
+    _backends[name] = Backend(name, function, priority, supports)
+
+
+def available_backends():
+    'Returns the names of the registered backends, fastest first.'
+
+    ordered = sorted(_backends.values(), key = lambda b: -b.priority)
+    return [ b.name for b in ordered ]
+
+
+def select_backend(N, r, p, dkLen, backend = None):
+    '''Returns the name of the backend that would be used to compute the
+       given parameters; backend (or PYSCRYPT_BACKEND) forces a backend.'''
+
+    if backend is None:
+        backend = _forced
+
+    if backend is not None:
+        if backend not in _backends:
+            raise ValueError('Unknown backend %r' % backend)
+        b = _backends[backend]
+        if b.supports is not None and not b.supports(N, r, p, dkLen):
+            raise ValueError('Backend %r cannot compute N=%d, r=%d, p=%d' % (backend, N, r, p))
+        return backend
+
+    for name in available_backends():
+        b = _backends[name]
+        if b.supports is None or b.supports(N, r, p, dkLen):
+            return name
+
+    raise ValueError('No backend can compute N=%d, r=%d, p=%d' % (N, r, p))
+
+
+def get_backend(name):
+    'Returns the registered Backend named name.'
+
+    if name not in _backends:
+        raise ValueError('Unknown backend %r' % name)
+    return _backends[name]
+
+
+# hashlib.scrypt (Python 3.6+ built against OpenSSL 1.1+)
+
+def hashlib_max_memory(N, r, p):
+    '''Returns the maxmem hashlib.scrypt needs for the given parameters.
+
+       OpenSSL requires room for B (128 * r * p bytes) and V, which it
+       allocates with two extra blocks (128 * r * (N + 2) bytes); a little
+       extra is added for its own bookkeeping.'''
+
+    return 128 * r * p + 128 * r * (N + 2) + 65536
+
+
+def _hashlib_supports(N, r, p, dkLen):
+    if hashlib_max_memory(N, r, p) > HASHLIB_MAX_MEMORY: return False
+    if dkLen > HASHLIB_MAX_MEMORY: return False
+
+    # OpenSSL's parameter limits (see EVP_PBE_scrypt)
+    if r * p >= (1 << 30): return False
+    if 16 * r <= 63 and N >= (1 << (16 * r)): return False
+
+    return True
+
+
+def _hashlib_scrypt(password, salt, N, r, p, dkLen):
+    return hashlib.scrypt(password, salt = salt, n = N, r = r, p = p, dklen = dkLen,
+                          maxmem = hashlib_max_memory(N, r, p))
+
+
+if hasattr(hashlib, 'scrypt'):
+    register_backend('hashlib', _hashlib_scrypt, priority = 100, supports = _hashlib_supports)
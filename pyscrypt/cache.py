@@ -0,0 +1,167 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2014 Richard Moore
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+# An opt-in cache of derived keys, for callers which derive the same key
+# repeatedly (e.g. re-verifying a passphrase). Pass it as the cache argument
+# to hash, derive or ScryptFile.
+#
+# Entries are looked up by an HMAC (with a random per-cache secret) of the
+# password, salt and parameters, so the raw password is never stored. The
+# derived keys are held in bytearrays, which are zeroed when evicted.
+
+import collections
+import hashlib
+import hmac
+import os
+import struct
+import threading
+import time
+
+
+# Python 3.3+ has a clock which cannot go backwards
+_now = getattr(time, 'monotonic', time.time)
+
+
+def _zero(buffer):
+    'Overwrites a bytearray with zeros, in place.'
+
+    buffer[:] = bytearray(len(buffer))
+
+
+class DerivedKeyCache(object):
+    '''A least-recently-used cache of derived keys.
+
+       max_bytes - the maximum total length of the cached keys
+       ttl       - seconds an entry remains valid after it is added (None
+                   for no limit)'''
+
+    def __init__(self, max_bytes = 64 * 1024, ttl = 300):
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+
+        # Secret for the lookup digests; never leaves this object
+        self._secret = os.urandom(32)
+
+        # digest => (key bytearray, expiry time), least recently used first
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    max_bytes = property(lambda s: s._max_bytes)
+    ttl = property(lambda s: s._ttl)
+
+    # Total length of the cached keys
+    size = property(lambda s: s._bytes)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _digest(self, password, salt, N, r, p, dkLen):
+        'Returns the lookup digest for the parameters.'
+
+        # The lengths prevent different (password, salt) pairs colliding
+        header = struct.pack('>QQQQQQ', len(password), len(salt), N, r, p, dkLen)
+        return hmac.new(self._secret, msg = header + password + salt, digestmod = hashlib.sha256).digest()
+
+    def _evict(self, digest):
+        'Removes an entry, zeroing its key. The lock must be held.'
+
+        (key, expires) = self._entries.pop(digest)
+        self._bytes -= len(key)
+        _zero(key)
+        self.evictions += 1
+
+    def get(self, password, salt, N, r, p, dkLen):
+        'Returns the cached derived key, or None if it is not cached (or has expired).'
+
+        digest = self._digest(password, salt, N, r, p, dkLen)
+
+        with self._lock:
+            entry = self._entries.get(digest)
+
+            if entry is not None and entry[1] is not None and entry[1] <= _now():
+                self._evict(digest)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            # Mark as most recently used
+            self._entries[digest] = self._entries.pop(digest)
+            self.hits += 1
+
+            return bytes(entry[0])
+
+    def put(self, password, salt, N, r, p, dkLen, key):
+        'Adds a derived key to the cache, evicting the least recently used entries as needed.'
+
+        if len(key) > self._max_bytes:
+            return
+
+        digest = self._digest(password, salt, N, r, p, dkLen)
+
+        expires = None
+        if self._ttl is not None:
+            expires = _now() + self._ttl
+
+        with self._lock:
+            if digest in self._entries:
+                self._evict(digest)
+
+            self._expire()
+
+            while self._entries and self._bytes + len(key) > self._max_bytes:
+                self._evict(next(iter(self._entries)))
+
+            self._entries[digest] = (bytearray(key), expires)
+            self._bytes += len(key)
+
+    def _expire(self):
+        'Evicts every expired entry. The lock must be held.'
+
+        now = _now()
+        expired = [ d for (d, (key, expires)) in self._entries.items() if expires is not None and expires <= now ]
+        for digest in expired:
+            self._evict(digest)
+
+    def expire(self):
+        'Removes (and zeros) every expired key.'
+
+        with self._lock:
+            self._expire()
+
+    def clear(self):
+        'Removes (and zeros) every cached key.'
+
+        with self._lock:
+            while self._entries:
+                self._evict(next(iter(self._entries)))
+
+    def __repr__(self):
+        return '<DerivedKeyCache entries=%d bytes=%d hits=%d misses=%d>' % (len(self._entries), self._bytes, self.hits, self.misses)
@@ -0,0 +1,169 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2014 Richard Moore
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+# Parameter calibration, similar to what the tarsnap scrypt utility does when
+# encrypting a file: the key derivation backend is timed on this machine, the
+# cost is modelled as  seconds = overhead + per_unit * N * r * p  and the
+# largest parameters which fit within a time and memory budget are chosen.
+
+import time
+
+from .backend import select_backend
+from .hash import derive
+
+
+# How long the largest measurement should take (at most)
+MEASURE_SECONDS = 0.25
+
+# The smallest N measured
+MEASURE_MIN_N = 16
+
+
+def memory_usage(N, r, p):
+    'Returns the approximate number of bytes of memory scrypt uses.'
+
+    return 128 * r * N + 128 * r * p
+
+
+def measure(r = 8, p = 1, backend = None, max_memory = None, seconds = MEASURE_SECONDS):
+    '''Times the key derivation backend for increasing N (doubling each
+       time) until one derivation takes at least seconds, or the next N
+       would exceed max_memory. Returns a list of (N, r, p, seconds).'''
+
+    points = [ ]
+
+    N = MEASURE_MIN_N
+    while True:
+        start = time.time()
+        derive(b'password', b'salt', N, r, p, 32, backend)
+        elapsed = time.time() - start
+
+        points.append((N, r, p, elapsed))
+
+        if elapsed >= seconds: break
+        if max_memory is not None and memory_usage(2 * N, r, p) > max_memory: break
+
+        N *= 2
+
+    return points
+
+
+def fit(points):
+    '''Returns (overhead, per_unit) fitting seconds = overhead + per_unit * N * r * p
+       to the measured points by least squares.'''
+
+    units = [ float(N * r * p) for (N, r, p, seconds) in points ]
+    seconds = [ s for (N, r, p, s) in points ]
+    count = len(points)
+
+    mean_units = sum(units) / count
+    mean_seconds = sum(seconds) / count
+
+    variance = sum((u - mean_units) ** 2 for u in units)
+    if count < 2 or variance == 0:
+        return (0.0, mean_seconds / mean_units)
+
+    per_unit = sum((u - mean_units) * (s - mean_seconds) for (u, s) in zip(units, seconds)) / variance
+    overhead = mean_seconds - per_unit * mean_units
+
+    # Noise in very fast measurements can push the line below the origin
+    if per_unit <= 0:
+        return (0.0, mean_seconds / mean_units)
+
+    return (max(0.0, overhead), per_unit)
+
+
+def predict(N, r, p, model):
+    'Returns the predicted seconds for the parameters, given a model from fit.'
+
+    (overhead, per_unit) = model
+    return overhead + per_unit * N * r * p
+
+
+def calibrate(target_seconds, max_memory, r = 8, backend = None, points = None):
+    '''Returns the scrypt parameters (N, r, p) which take about target_seconds
+       on this machine while using at most max_memory bytes.
+
+       As the tarsnap scrypt utility does, N is made as large as possible
+       (up to the memory limit) with p = 1; if the memory limit is reached
+       before the time target, p is increased instead.
+
+       points, if given, are measurements from measure to use instead of
+       benchmarking again.'''
+
+    if points is None:
+        points = measure(r = r, backend = backend, max_memory = max_memory)
+    model = fit(points)
+
+    # The number of N * r * p units that fit in the target time
+    (overhead, per_unit) = model
+    units = max(0.0, target_seconds - overhead) / per_unit
+
+    # The largest N that fits in memory, and the largest that fits in time
+    N_memory = 2
+    while memory_usage(2 * N_memory, r, 1) <= max_memory:
+        N_memory *= 2
+
+    N_time = 2
+    while 2 * N_time * r <= units:
+        N_time *= 2
+
+    if N_time <= N_memory:
+        return (N_time, r, 1)
+
+    # Memory bound; make up the time with parallelization
+    N = N_memory
+    p = max(1, int(units // (N * r)))
+    p = min(p, ((1 << 30) - 1) // r)
+
+    return (N, r, p)
+
+
+def main(arguments = None):
+    'Command line interface; see python -m pyscrypt calibrate --help.'
+
+    import argparse
+
+    parser = argparse.ArgumentParser(prog = 'python -m pyscrypt calibrate',
+                                     description = 'Measure scrypt on this machine and pick N, r and p.')
+    parser.add_argument('--target', type = float, default = 1.0, help = 'target seconds per derivation (default: 1.0)')
+    parser.add_argument('--memory', type = int, default = 128 * 1024 * 1024, help = 'maximum bytes of memory (default: 128MiB)')
+    parser.add_argument('-r', type = int, default = 8, help = 'block size parameter (default: 8)')
+    parser.add_argument('--backend', default = None, help = 'key derivation backend (default: fastest available)')
+    args = parser.parse_args(arguments)
+
+    backend = select_backend(MEASURE_MIN_N, args.r, 1, 32, args.backend)
+    print("Backend: %s" % backend)
+
+    points = measure(r = args.r, backend = backend, max_memory = args.memory)
+    model = fit(points)
+
+    print("%10s %4s %4s %12s %12s %12s" % ('N', 'r', 'p', 'memory', 'seconds', 'predicted'))
+    for (N, r, p, seconds) in points:
+        print("%10d %4d %4d %12d %12.6f %12.6f" % (N, r, p, memory_usage(N, r, p), seconds, predict(N, r, p, model)))
+
+    (N, r, p) = calibrate(args.target, args.memory, r = args.r, backend = backend, points = points)
+    print("")
+    print("Chosen: N=%d r=%d p=%d (memory=%d bytes, predicted=%.3fs)" % (N, r, p, memory_usage(N, r, p), predict(N, r, p, model)))
+
+    return (N, r, p)
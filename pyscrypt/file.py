@@ -51,8 +51,9 @@ import math
 import os
 import struct
 
-from .hash import hash
+from .hash import derive
 from . import aesctr
+from . import instrument
 
 
 BLOCK_SIZE = 1024
@@ -116,7 +117,7 @@ class ScryptFile(object):
     MODE_READ  = MODE_READ
     MODE_WRITE = MODE_WRITE
 
-    def __init__(self, fp, password, N = None, r = None, p = None, salt = None, mode = None):
+    def __init__(self, fp, password, N = None, r = None, p = None, salt = None, mode = None, backend = None, cache = None, key = None, max_memory = None, workers = None):
 
         # No explicit mode...
         if mode is None:
@@ -144,17 +145,23 @@ class ScryptFile(object):
             if N is None or r is None or p is None:
                 raise Exception("Must specify N, r and p for file open for writing")
             if salt is None:
+                if key is not None:
+                    raise ValueError('A precomputed key requires the salt it was derived with')
                 salt = os.urandom(32)
             elif len(salt) != 32:
                 raise ValueError('The salt must be 32 bytes in length')
-            key = hash(password, salt, N, r, p, 64)
+            if key is None:
+                (key, backend) = derive(password, salt, N, r, p, 64, backend, cache, max_memory)
         elif self._mode in _allowed_read:
             if N is not None or r is not None or p is not None or salt is not None:
                 raise Exception("Cannot specify N, r, p or salt for file open for reading (values detected from file)")
-            key = None
         else:
             raise Exception('Unknown mode %r' % self._mode)
 
+        # A precomputed key (e.g. derived elsewhere with derive(..., 64))
+        if key is not None and len(key) != 64:
+            raise ValueError('The key must be 64 bytes in length')
+
         # scrypt parameters for derived key
         self._password = password
         self._salt = salt
@@ -164,6 +171,18 @@ class ScryptFile(object):
         self._r = r
         self._p = p
 
+        # The key derivation backend requested (reading) or used (writing)
+        self._backend = backend
+
+        # The DerivedKeyCache to consult when reading (if any)
+        self._cache = cache
+
+        # The limit on ROMix's V when reading (see hash)
+        self._max_memory = max_memory
+
+        # Worker processes for large reads and writes (see aesctr)
+        self._workers = workers
+
         # File state
         if hasattr(fp, 'close'):
             self._filename = None
@@ -201,6 +220,9 @@ class ScryptFile(object):
     r = property(lambda s: s._load_get_attr('_r'))
     p = property(lambda s: s._load_get_attr('_p'))
 
+    # The key derivation backend used (see backend.py)
+    backend = property(lambda s: s._load_get_attr('_backend'))
+
     closed = property(lambda s: s._closed)
     valid = property(lambda s: s._valid)
 
@@ -283,11 +305,11 @@ class ScryptFile(object):
         if self.closed: raise ValueError('file closed')
         if self._mode in _allowed_write:
             raise Exception('file opened for write only')
-        if self._read_finished: return None
-
         line = b''
-        while not line.endswith(b'\n') and not self._read_finished and (size is None or len(line) <= size):
-            line += self.read(1)
+        while not line.endswith(b'\n') and (size is None or len(line) < size):
+            byte = self.read(1)
+            if not byte: break
+            line += byte
         return line
 
     def readlines(self, sizehint = None):
@@ -302,15 +324,19 @@ class ScryptFile(object):
     def __iter__(self):
         while True:
             line = self.readline()
-            if not line: raise StopIteration()
+            if not line: return
             yield line
 
     def _read_header(self):
         '''Read and parse the header and calculate derived keys.'''
 
+        header_started = instrument.start()
+
         try:
             # Read the entire header
+            started = instrument.start()
             header = self._fp.read(96)
+            instrument.report('file.io.read', started, bytes = len(header))
             if len(header) != 96:
                 raise InvalidScryptFileFormat("Incomplete header")
 
@@ -328,8 +354,9 @@ class ScryptFile(object):
             (self._r, self._p) = struct.unpack('>II', header[8:16])
             self._salt = header[16:48]
 
-            # Generate the key
-            self._key = hash(self._password, self._salt, self._N, self._r, self._p, 64)
+            # Generate the key (unless it was provided)
+            if self._key is None:
+                (self._key, self._backend) = derive(self._password, self._salt, self._N, self._r, self._p, 64, self._backend, self._cache, self._max_memory)
 
             # Header Checksum
             checksum = header[48:64]
@@ -345,10 +372,12 @@ class ScryptFile(object):
             self._checksumer.update(header[64:96])
 
             # Prepare the AES engine
-            self._crypto = aesctr.AESCounterModeOfOperation(key = self.key[:32])
+            self._crypto = aesctr.AESCounterModeOfOperation(key = self.key[:32], workers = self._workers)
 
             self._done_header = True
 
+            instrument.report('file.header', header_started, bytes = 96)
+
         except InvalidScryptFileFormat as e:
             self.close()
             raise e
@@ -376,6 +405,8 @@ class ScryptFile(object):
         if not self._done_header:
             self._read_header()
 
+        read_started = instrument.start()
+
         # The encrypted file has been entirely read, so return as much as they want
         # and remove the returned portion from the decrypted buffer
         if self._read_finished:
@@ -383,12 +414,16 @@ class ScryptFile(object):
                 decrypted = self._decrypted_buffer
             else:
                 decrypted = self._decrypted_buffer[:size]
-            self._decrypted_buffer = self._decrypted[len(decrypted):]
+            self._decrypted_buffer = self._decrypted_buffer[len(decrypted):]
+            instrument.report('file.read', read_started, bytes = len(decrypted))
             return decrypted
 
         # Read everything in one chunk
         if size is None or size < 0:
-            self._encrypted_buffer = self._fp.read()
+            started = instrument.start()
+            data = self._fp.read()
+            self._encrypted_buffer += data
+            instrument.report('file.io.read', started, bytes = len(data))
             self._read_finished = True
 
         else:
@@ -400,8 +435,11 @@ class ScryptFile(object):
                 available = len(self._decrypted_buffer) + len(self._encrypted_buffer) - 32
                 if available >= size: break
 
-                # Read a little extra for the possible final checksum
-                data = self._fp.read(BLOCK_SIZE)
+                # Read a little extra for the possible final checksum (and
+                # all that is missing at once, for large reads)
+                started = instrument.start()
+                data = self._fp.read(max(BLOCK_SIZE, size - available))
+                instrument.report('file.io.read', started, bytes = len(data))
 
                 # No data left; we're done
                 if not data:
@@ -414,7 +452,9 @@ class ScryptFile(object):
         safe = self._encrypted_buffer[:-32]
         self._encrypted_buffer = self._encrypted_buffer[-32:]
         self._decrypted_buffer += self._crypto.decrypt(safe)
+        started = instrument.start()
         self._checksumer.update(safe)
+        instrument.report('file.hmac', started, bytes = len(safe))
 
         # We read all the bytes, only the checksum remains
         if self._read_finished:
@@ -424,6 +464,8 @@ class ScryptFile(object):
         decrypted = self._decrypted_buffer[:size]
         self._decrypted_buffer = self._decrypted_buffer[size:]
 
+        instrument.report('file.read', read_started, bytes = len(decrypted))
+
         return decrypted
 
     # Write operations
@@ -460,7 +502,7 @@ class ScryptFile(object):
         self._fp.write(header)
 
         # Prepare the AES engine
-        self._crypto = aesctr.AESCounterModeOfOperation(key = self.key[:32])
+        self._crypto = aesctr.AESCounterModeOfOperation(key = self.key[:32], workers = self._workers)
         #self._crypto = aes(self.key[:32])
 
         self._done_header = True
@@ -472,16 +514,25 @@ class ScryptFile(object):
         if not self._done_header:
             self._write_header()
 
+        finalize_started = instrument.start()
+
         # Write the remaining decrypted part to disk
         block = self._crypto.encrypt(self._decrypted_buffer)
-        self._decrypted = ''
-        self._fp.write(block)
+        self._decrypted_buffer = b''
+
+        started = instrument.start()
         self._checksumer.update(block)
+        instrument.report('file.hmac', started, bytes = len(block))
 
         # Write the final checksum
+        started = instrument.start()
+        self._fp.write(block)
         self._fp.write(self._checksumer.digest())
+        instrument.report('file.io.write', started, bytes = len(block) + 32)
         self._valid = True
 
+        instrument.report('file.finalize', finalize_started, bytes = len(block))
+
     def write(self, str):
         '''Write string str to the underlying file.
 
@@ -498,8 +549,18 @@ class ScryptFile(object):
         if not self._done_header:
             self._write_header()
 
+        write_started = instrument.start()
+
         # Encrypt and write the data
         encrypted = self._crypto.encrypt(str)
+
+        started = instrument.start()
         self._checksumer.update(encrypted)
+        instrument.report('file.hmac', started, bytes = len(encrypted))
+
+        started = instrument.start()
         self._fp.write(encrypted)
+        instrument.report('file.io.write', started, bytes = len(encrypted))
+
+        instrument.report('file.write', write_started, bytes = len(encrypted))
 
@@ -21,9 +21,17 @@
 # THE SOFTWARE.
 
 
+import array
 import hashlib
 import hmac
 import struct
+import sys
+
+from . import arena
+from . import hash_swar
+from . import instrument
+from .backend import get_backend, register_backend, select_backend
+from .scratchpad import open_scratchpad
 
 
 # Python 2
@@ -53,6 +61,37 @@ else:
         return bytes(array)
 
 
+# Typecode for compact arrays of 32-bit words (B, XY and V); unsigned int
+# is 32 bits on every common platform, but fall back to unsigned long
+WORD = 'I' if array.array('I').itemsize == 4 else 'L'
+
+# ROMix engines (see available_engines); the numpy engine pays a fixed cost
+# per array operation, so only pays off once enough lanes share each one
+# (about even at 8 lanes, twice as fast at 16). The swar engine keeps V as
+# big Python ints (several times the memory), so is only used when asked for
+NUMPY_MIN_LANES = 8
+
+# The default limit on the scratchpad used by hash_many for one batch
+HASH_MANY_MAX_MEMORY = 256 * 1024 * 1024
+
+# PBKDF2 in C (Python 2.7.8+ and 3.4+)
+_pbkdf2_hmac = getattr(hashlib, 'pbkdf2_hmac', None)
+
+# The NumPy engine module; None until first use, False if unavailable
+_numpy_engine = None
+
+# Executors for running SMix lanes in parallel (see set_executor)
+_executor = None
+_executors = { }
+
+def prf(key, message):
+    'The psuedorandom function used by scrypt; HMAC-SHA256.'
+    return hmac.new(key = key, msg = message, digestmod = hashlib.sha256).digest()
+
+# (pbkdf2_single's prf argument shadows the name)
+_prf = prf
+
+
 def pbkdf2_single(password, salt, key_length, prf):
     '''Returns the result of the Password-Based Key Derivation Function 2 with
        a single iteration (i.e. count = 1).
@@ -62,22 +101,103 @@ def pbkdf2_single(password, salt, key_length, prf):
        See http://en.wikipedia.org/wiki/PBKDF2
     '''
 
-    block_number = 0
-    result = b''
+    # scrypt's own HMAC-SHA256 has a faster engine
+    if prf is _prf:
+        return PBKDF2(password).derive(salt, key_length)
+
+    blocks = [ ]
+    for block_number in xrange(1, (key_length + 31) // 32 + 1):
+        blocks.append(prf(password, salt + struct.pack('>L', block_number)))
+
+    return b''.join(blocks)[:key_length]
+
+
+class PBKDF2(object):
+    '''PBKDF2-HMAC-SHA256 with a single iteration, keyed once with password so
+       repeated derivations (scrypt makes two) do not rehash the HMAC pads.
+
+       Uses hashlib.pbkdf2_hmac when available; otherwise the keyed inner and
+       outer SHA256 states are copied for each 32 byte block.'''
+
+    def __init__(self, password):
+        self._password = password
+
+        # The HMAC inner and outer states after the padded key (built lazily)
+        self._inner = None
+        self._outer = None
+
+    def _keyed(self):
+        if self._inner is None:
+            key = self._password
+            if len(key) > 64:
+                key = hashlib.sha256(key).digest()
+            key = bytearray(key) + bytearray(64 - len(key))
+
+            self._inner = hashlib.sha256(chars_to_bytes([ c ^ 0x36 for c in key ]))
+            self._outer = hashlib.sha256(chars_to_bytes([ c ^ 0x5c for c in key ]))
+
+        return (self._inner, self._outer)
+
+    def derive_into(self, salt, output):
+        '''Fills the writable buffer output (e.g. a bytearray) with
+           len(output) bytes of PBKDF2(password, salt) and returns it.'''
 
-    # The iterations
-    while len(result) < key_length:
-        block_number += 1
-        result += prf(password, salt + struct.pack('>L', block_number))
+        key_length = len(output)
 
-    return result[:key_length]
+        if _pbkdf2_hmac is not None:
+            output[0:key_length] = _pbkdf2_hmac('sha256', self._password, salt, 1, key_length)
+            return output
 
+        (inner, outer) = self._keyed()
 
-def salsa20_8(B):
-    '''Salsa 20/8 stream cypher; Used by BlockMix. See http://en.wikipedia.org/wiki/Salsa20'''
+        # The salt is the same for every block; only the block number changes
+        inner = inner.copy()
+        inner.update(salt)
 
-    # Create a working copy
-    x = B[:]
+        for offset in xrange(0, key_length, 32):
+            h = inner.copy()
+            h.update(struct.pack('>L', offset // 32 + 1))
+            o = outer.copy()
+            o.update(h.digest())
+
+            length = min(32, key_length - offset)
+            output[offset:offset + length] = o.digest()[:length]
+
+        return output
+
+    def derive(self, salt, key_length):
+        'Returns key_length bytes of PBKDF2(password, salt).'
+
+        if _pbkdf2_hmac is not None:
+            return _pbkdf2_hmac('sha256', self._password, salt, 1, key_length)
+
+        return bytes(self.derive_into(salt, bytearray(key_length)))
+
+
+def salsa20_8(BY, Xi, Bi, Yi):
+    '''Salsa 20/8 stream cypher; Used by BlockMix. See http://en.wikipedia.org/wiki/Salsa20
+
+       Computes Salsa20/8(BY[Xi:Xi + 16] ^ BY[Bi:Bi + 16]) into BY[Yi:Yi + 16]
+       (which may overlap either input) without allocating any buffers.'''
+
+    # Load the input (X ^ B) into locals, keeping the originals in j; the
+    # words may temporarily exceed 32 bits as only the additions are masked
+    x0 = j0 = BY[Xi] ^ BY[Bi]
+    x1 = j1 = BY[Xi + 1] ^ BY[Bi + 1]
+    x2 = j2 = BY[Xi + 2] ^ BY[Bi + 2]
+    x3 = j3 = BY[Xi + 3] ^ BY[Bi + 3]
+    x4 = j4 = BY[Xi + 4] ^ BY[Bi + 4]
+    x5 = j5 = BY[Xi + 5] ^ BY[Bi + 5]
+    x6 = j6 = BY[Xi + 6] ^ BY[Bi + 6]
+    x7 = j7 = BY[Xi + 7] ^ BY[Bi + 7]
+    x8 = j8 = BY[Xi + 8] ^ BY[Bi + 8]
+    x9 = j9 = BY[Xi + 9] ^ BY[Bi + 9]
+    x10 = j10 = BY[Xi + 10] ^ BY[Bi + 10]
+    x11 = j11 = BY[Xi + 11] ^ BY[Bi + 11]
+    x12 = j12 = BY[Xi + 12] ^ BY[Bi + 12]
+    x13 = j13 = BY[Xi + 13] ^ BY[Bi + 13]
+    x14 = j14 = BY[Xi + 14] ^ BY[Bi + 14]
+    x15 = j15 = BY[Xi + 15] ^ BY[Bi + 15]
 
     # Expanded form of this code. The expansion is significantly faster but
     # this is much easier to understand
@@ -96,133 +216,447 @@ def salsa20_8(B):
     #     a = (x[a1] + x[a2]) & 0xffffffff
     #     x[destination] ^= ((a << b)  | (a >> (32 - b))) & 0xffffffff
     for i in (8, 6, 4, 2):
-        a = (x[0] + x[12]) & 0xffffffff
-        x[4] ^= ((a << 7) | (a >> 25))
-        a = (x[4] + x[0]) & 0xffffffff
-        x[8] ^= ((a << 9) | (a >> 23))
-        a = (x[8] + x[4]) & 0xffffffff
-        x[12] ^= ((a << 13) | (a >> 19))
-        a = (x[12] + x[8]) & 0xffffffff
-        x[0] ^= ((a << 18) | (a >> 14))
-        a = (x[5] + x[1]) & 0xffffffff
-        x[9] ^= ((a << 7) | (a >> 25))
-        a = (x[9] + x[5]) & 0xffffffff
-        x[13] ^= ((a << 9) | (a >> 23))
-        a = (x[13] + x[9]) & 0xffffffff
-        x[1] ^= ((a << 13) | (a >> 19))
-        a = (x[1] + x[13]) & 0xffffffff
-        x[5] ^= ((a << 18) | (a >> 14))
-        a = (x[10] + x[6]) & 0xffffffff
-        x[14] ^= ((a << 7) | (a >> 25))
-        a = (x[14] + x[10]) & 0xffffffff
-        x[2] ^= ((a << 9) | (a >> 23))
-        a = (x[2] + x[14]) & 0xffffffff
-        x[6] ^= ((a << 13) | (a >> 19))
-        a = (x[6] + x[2]) & 0xffffffff
-        x[10] ^= ((a << 18) | (a >> 14))
-        a = (x[15] + x[11]) & 0xffffffff
-        x[3] ^= ((a << 7) | (a >> 25))
-        a = (x[3] + x[15]) & 0xffffffff
-        x[7] ^= ((a << 9) | (a >> 23))
-        a = (x[7] + x[3]) & 0xffffffff
-        x[11] ^= ((a << 13) | (a >> 19))
-        a = (x[11] + x[7]) & 0xffffffff
-        x[15] ^= ((a << 18) | (a >> 14))
-        a = (x[0] + x[3]) & 0xffffffff
-        x[1] ^= ((a << 7) | (a >> 25))
-        a = (x[1] + x[0]) & 0xffffffff
-        x[2] ^= ((a << 9) | (a >> 23))
-        a = (x[2] + x[1]) & 0xffffffff
-        x[3] ^= ((a << 13) | (a >> 19))
-        a = (x[3] + x[2]) & 0xffffffff
-        x[0] ^= ((a << 18) | (a >> 14))
-        a = (x[5] + x[4]) & 0xffffffff
-        x[6] ^= ((a << 7) | (a >> 25))
-        a = (x[6] + x[5]) & 0xffffffff
-        x[7] ^= ((a << 9) | (a >> 23))
-        a = (x[7] + x[6]) & 0xffffffff
-        x[4] ^= ((a << 13) | (a >> 19))
-        a = (x[4] + x[7]) & 0xffffffff
-        x[5] ^= ((a << 18) | (a >> 14))
-        a = (x[10] + x[9]) & 0xffffffff
-        x[11] ^= ((a << 7) | (a >> 25))
-        a = (x[11] + x[10]) & 0xffffffff
-        x[8] ^= ((a << 9) | (a >> 23))
-        a = (x[8] + x[11]) & 0xffffffff
-        x[9] ^= ((a << 13) | (a >> 19))
-        a = (x[9] + x[8]) & 0xffffffff
-        x[10] ^= ((a << 18) | (a >> 14))
-        a = (x[15] + x[14]) & 0xffffffff
-        x[12] ^= ((a << 7) | (a >> 25))
-        a = (x[12] + x[15]) & 0xffffffff
-        x[13] ^= ((a << 9) | (a >> 23))
-        a = (x[13] + x[12]) & 0xffffffff
-        x[14] ^= ((a << 13) | (a >> 19))
-        a = (x[14] + x[13]) & 0xffffffff
-        x[15] ^= ((a << 18) | (a >> 14))
+        a = (x0 + x12) & 0xffffffff
+        x4 ^= ((a << 7) | (a >> 25))
+        a = (x4 + x0) & 0xffffffff
+        x8 ^= ((a << 9) | (a >> 23))
+        a = (x8 + x4) & 0xffffffff
+        x12 ^= ((a << 13) | (a >> 19))
+        a = (x12 + x8) & 0xffffffff
+        x0 ^= ((a << 18) | (a >> 14))
+        a = (x5 + x1) & 0xffffffff
+        x9 ^= ((a << 7) | (a >> 25))
+        a = (x9 + x5) & 0xffffffff
+        x13 ^= ((a << 9) | (a >> 23))
+        a = (x13 + x9) & 0xffffffff
+        x1 ^= ((a << 13) | (a >> 19))
+        a = (x1 + x13) & 0xffffffff
+        x5 ^= ((a << 18) | (a >> 14))
+        a = (x10 + x6) & 0xffffffff
+        x14 ^= ((a << 7) | (a >> 25))
+        a = (x14 + x10) & 0xffffffff
+        x2 ^= ((a << 9) | (a >> 23))
+        a = (x2 + x14) & 0xffffffff
+        x6 ^= ((a << 13) | (a >> 19))
+        a = (x6 + x2) & 0xffffffff
+        x10 ^= ((a << 18) | (a >> 14))
+        a = (x15 + x11) & 0xffffffff
+        x3 ^= ((a << 7) | (a >> 25))
+        a = (x3 + x15) & 0xffffffff
+        x7 ^= ((a << 9) | (a >> 23))
+        a = (x7 + x3) & 0xffffffff
+        x11 ^= ((a << 13) | (a >> 19))
+        a = (x11 + x7) & 0xffffffff
+        x15 ^= ((a << 18) | (a >> 14))
+        a = (x0 + x3) & 0xffffffff
+        x1 ^= ((a << 7) | (a >> 25))
+        a = (x1 + x0) & 0xffffffff
+        x2 ^= ((a << 9) | (a >> 23))
+        a = (x2 + x1) & 0xffffffff
+        x3 ^= ((a << 13) | (a >> 19))
+        a = (x3 + x2) & 0xffffffff
+        x0 ^= ((a << 18) | (a >> 14))
+        a = (x5 + x4) & 0xffffffff
+        x6 ^= ((a << 7) | (a >> 25))
+        a = (x6 + x5) & 0xffffffff
+        x7 ^= ((a << 9) | (a >> 23))
+        a = (x7 + x6) & 0xffffffff
+        x4 ^= ((a << 13) | (a >> 19))
+        a = (x4 + x7) & 0xffffffff
+        x5 ^= ((a << 18) | (a >> 14))
+        a = (x10 + x9) & 0xffffffff
+        x11 ^= ((a << 7) | (a >> 25))
+        a = (x11 + x10) & 0xffffffff
+        x8 ^= ((a << 9) | (a >> 23))
+        a = (x8 + x11) & 0xffffffff
+        x9 ^= ((a << 13) | (a >> 19))
+        a = (x9 + x8) & 0xffffffff
+        x10 ^= ((a << 18) | (a >> 14))
+        a = (x15 + x14) & 0xffffffff
+        x12 ^= ((a << 7) | (a >> 25))
+        a = (x12 + x15) & 0xffffffff
+        x13 ^= ((a << 9) | (a >> 23))
+        a = (x13 + x12) & 0xffffffff
+        x14 ^= ((a << 13) | (a >> 19))
+        a = (x14 + x13) & 0xffffffff
+        x15 ^= ((a << 18) | (a >> 14))
 
 
     # Add the original values
-    for i in xrange(0, 16):
-        B[i] = (B[i] + x[i]) & 0xffffffff
+    BY[Yi] = (j0 + x0) & 0xffffffff
+    BY[Yi + 1] = (j1 + x1) & 0xffffffff
+    BY[Yi + 2] = (j2 + x2) & 0xffffffff
+    BY[Yi + 3] = (j3 + x3) & 0xffffffff
+    BY[Yi + 4] = (j4 + x4) & 0xffffffff
+    BY[Yi + 5] = (j5 + x5) & 0xffffffff
+    BY[Yi + 6] = (j6 + x6) & 0xffffffff
+    BY[Yi + 7] = (j7 + x7) & 0xffffffff
+    BY[Yi + 8] = (j8 + x8) & 0xffffffff
+    BY[Yi + 9] = (j9 + x9) & 0xffffffff
+    BY[Yi + 10] = (j10 + x10) & 0xffffffff
+    BY[Yi + 11] = (j11 + x11) & 0xffffffff
+    BY[Yi + 12] = (j12 + x12) & 0xffffffff
+    BY[Yi + 13] = (j13 + x13) & 0xffffffff
+    BY[Yi + 14] = (j14 + x14) & 0xffffffff
+    BY[Yi + 15] = (j15 + x15) & 0xffffffff
+
+
+def blockmix_salsa8(BY, Bi, Yi, r):
+    '''Blockmix; Used by SMix.
+
+       Reads the 32 * r words at BY[Bi] and writes the result to BY[Yi]. Each
+       sub-block is written straight to its shuffled position, so no
+       temporary buffers or copies are needed.'''
+
+    Xi = Bi + (2 * r - 1) * 16                                    # BlockMix - 1
+
+    for i in xrange(0, 2 * r):                                    # BlockMix - 2
+        aod = Yi + ((i // 2) + (i % 2) * r) * 16                  # BlockMix - 4, 6
+        salsa20_8(BY, Xi, Bi + i * 16, aod)                       # BlockMix - 3
+        Xi = aod
 
 
-def blockmix_salsa8(BY, Yi, r):
-    '''Blockmix; Used by SMix.'''
+def _views(*arrays):
+    '''Returns memoryviews of the arrays, so they can be copied between
+       without creating a temporary slice (Python 2 arrays do not support
+       it, so the arrays themselves are returned instead).'''
 
-    start = (2 * r - 1) * 16
-    X = BY[start:start + 16]                                      # BlockMix - 1
+    # A memoryview (e.g. of a scratchpad) is used as is, so releasing it
+    # releases every use of it
+    try:
+        return [ a if isinstance(a, memoryview) else memoryview(a) for a in arrays ]
+    except TypeError:
+        return arrays
 
-    for i in xrange(0, 2 * r):                                    # BlockMix - 2
 
-        for xi in xrange(0, 16):                                  # BlockMix - 3(inner)
-            X[xi] ^= BY[i * 16 + xi]
+def smix_fill(X, Xi, V, r, start, stop):
+    '''ROMix steps 2 - 4 for iterations start through stop - 1; the current
+       block is at X[Xi] (X is a 64 * r word buffer whose two halves take
+       turns holding the current block). Returns the new Xi.'''
+
+    words = 32 * r
+    (Vv, Xv) = _views(V, X)
+
+    for i in xrange(start, stop):                    # ROMix - 2
+        aod = i * words                              # ROMix - 3
+        Vv[aod:aod + words] = Xv[Xi:Xi + words]
+        Yi = words - Xi
+        blockmix_salsa8(X, Xi, Yi, r)                # ROMix - 4
+        Xi = Yi
+
+    return Xi
 
-        salsa20_8(X)                                              # BlockMix - 3(outer)
-        aod = Yi + i * 16                                         # BlockMix - 4
-        BY[aod:aod + 16] = X[:16]
 
-    for i in xrange(0, r):                                        # BlockMix - 6 (and below)
-        aos = Yi + i * 32
-        aod = i * 16
-        BY[aod:aod + 16] = BY[aos:aos + 16]
+def smix_mix(X, Xi, V, r, N, count):
+    '''ROMix steps 6 - 9 for count iterations; see smix_fill. Returns the
+       new Xi.'''
 
-    for i in xrange(0, r):
-        aos = Yi + (i * 2 + 1) * 16
-        aod = (i + r) * 16
-        BY[aod:aod + 16] = BY[aos:aos + 16]
+    words = 32 * r
 
+    for i in xrange(0, count):                       # ROMix - 6
+        j = X[Xi + (2 * r - 1) * 16] & (N - 1)       # ROMix - 7
+        aos = j * words
+        for xi in xrange(Xi, Xi + words):            # ROMix - 8(inner)
+            X[xi] ^= V[aos]
+            aos += 1
 
-def smix(B, Bi, r, N, V, X):
-    '''SMix; a specific case of ROMix. See scrypt.pdf in the links above.'''
+        Yi = words - Xi
+        blockmix_salsa8(X, Xi, Yi, r)                # ROMix - 9(outer)
+        Xi = Yi
 
-    X[:32 * r] = B[Bi:Bi + 32 * r]                   # ROMix - 1
+    return Xi
+
+
+def smix_fill_tmto(X, Xi, V, r, N, interval):
+    '''ROMix steps 2 - 4, keeping only every interval-th block; block i is
+       kept at V[i // interval] if i is a multiple of interval. Returns the
+       new Xi.'''
+
+    words = 32 * r
+    (Vv, Xv) = _views(V, X)
 
     for i in xrange(0, N):                           # ROMix - 2
-        aod = i * 32 * r                             # ROMix - 3
-        V[aod:aod + 32 * r] = X[:32 * r]
-        blockmix_salsa8(X, 32 * r, r)                # ROMix - 4
+        if i % interval == 0:                        # ROMix - 3
+            aod = (i // interval) * words
+            Vv[aod:aod + words] = Xv[Xi:Xi + words]
+        Yi = words - Xi
+        blockmix_salsa8(X, Xi, Yi, r)                # ROMix - 4
+        Xi = Yi
+
+    return Xi
+
+
+def smix_mix_tmto(X, Xi, V, T, r, N, interval):
+    '''ROMix steps 6 - 9 over V filled by smix_fill_tmto; each V[j] is
+       recomputed in T (a 64 * r word scratch buffer) from the nearest kept
+       block before it. Returns the new Xi.'''
+
+    words = 32 * r
+    (Vv, Tv) = _views(V, T)
 
     for i in xrange(0, N):                           # ROMix - 6
-        j = X[(2 * r - 1) * 16] & (N - 1)            # ROMix - 7
-        for xi in xrange(0, 32 * r):                 # ROMix - 8(inner)
-            X[xi] ^= V[j * 32 * r + xi]
+        j = X[Xi + (2 * r - 1) * 16] & (N - 1)       # ROMix - 7
 
-        blockmix_salsa8(X, 32 * r, r)                # ROMix - 9(outer)
+        # Recompute V[j] from the kept block
+        aos = (j // interval) * words
+        Tv[0:words] = Vv[aos:aos + words]
+        Ti = 0
+        for step in xrange(0, j % interval):
+            blockmix_salsa8(T, Ti, words - Ti, r)
+            Ti = words - Ti
 
-    B[Bi:Bi + 32 * r] = X[:32 * r]                   # ROMix - 10
+        for xi in xrange(Xi, Xi + words):            # ROMix - 8(inner)
+            X[xi] ^= T[Ti]
+            Ti += 1
 
+        Yi = words - Xi
+        blockmix_salsa8(X, Xi, Yi, r)                # ROMix - 9(outer)
+        Xi = Yi
 
+    return Xi
 
-def hash(password, salt, N, r, p, dkLen):
-    """Returns the result of the scrypt password-based key derivation function.
 
-       Constraints:
-         r * p < (2 ** 30)
-         dkLen <= (((2 ** 32) - 1) * 32
-         N must be a power of 2 greater than 1 (eg. 2, 4, 8, 16, 32...)
-         N, r, p must be positive
-     """
+def tmto_interval(N, r, max_memory):
+    '''Returns the interval between the blocks of V kept by SMix so that V
+       fits in max_memory bytes (1 keeps every block, as does None).'''
+
+    if max_memory is None:
+        return 1
+
+    blocks = max_memory // (128 * r)
+    if blocks < 1:
+        raise ValueError('max_memory must be at least 128 * r bytes')
+
+    return max(1, (N + blocks - 1) // blocks)
+
+
+def smix(B, Bi, r, N, V, X, interval = 1, T = None):
+    '''SMix; a specific case of ROMix. See scrypt.pdf in the links above.
+
+       X is a 64 * r word scratch buffer; its two halves take turns holding
+       the current block, so BlockMix never needs to copy its output back.
+
+       An interval greater than 1 trades time for memory; V only holds every
+       interval-th block (N / interval blocks) and the rest are recomputed
+       when needed, in T (another 64 * r word buffer), for about
+       interval / 2 times the BlockMix work in steps 6 - 9.'''
+
+    words = 32 * r
+    (Bv, Xv) = _views(B, X)
+
+    Xv[0:words] = Bv[Bi:Bi + words]                  # ROMix - 1
+
+    started = instrument.start()
+    if interval == 1:
+        Xi = smix_fill(X, 0, V, r, 0, N)
+    else:
+        Xi = smix_fill_tmto(X, 0, V, r, N, interval)
+    instrument.report('hash.romix.fill', started, bytes = 4 * words * N, blocks = N)
+
+    started = instrument.start()
+    if interval == 1:
+        Xi = smix_mix(X, Xi, V, r, N, N)
+    else:
+        Xi = smix_mix_tmto(X, Xi, V, T, r, N, interval)
+    instrument.report('hash.romix.mix', started, bytes = 4 * words * N, blocks = N)
+
+    Bv[Bi:Bi + words] = Xv[Xi:Xi + words]            # ROMix - 10
+
+
+def available_engines():
+    'Returns the names of the ROMix engines that can be used on this system.'
+
+    engines = ['python', 'swar']
+    if _load_numpy_engine() is not None:
+        engines.append('numpy')
+    return engines
+
+
+def _load_numpy_engine():
+    'Returns the NumPy engine module (imported on first use) or None.'
+
+    global _numpy_engine
+
+    if _numpy_engine is None:
+        try:
+            from . import hash_numpy
+            _numpy_engine = hash_numpy
+        except ImportError:
+            _numpy_engine = False
+
+    return _numpy_engine or None
+
+
+def select_engine(lanes, scratchpad = None):
+    '''Returns the fastest available ROMix engine for lanes independent SMix
+       lanes (that supports scratchpad, if given).'''
+
+    if lanes >= NUMPY_MIN_LANES and _load_numpy_engine() is not None:
+        return 'numpy'
+    return 'python'
+
+
+def engine_memory(engine, lanes, r, N):
+    '''Returns (an estimate of) the bytes of V the named ROMix engine uses
+       for lanes lanes, without a max_memory limit.'''
+
+    if engine == 'swar':
+        return hash_swar.memory(lanes, r, N)
+
+    # The numpy engine keeps V for every lane at once; the python engine
+    # runs the lanes one at a time, reusing V
+    if engine == 'numpy':
+        return lanes * 128 * r * N
+    return 128 * r * N
+
+
+def _fits(engine, lanes, r, N, max_memory):
+    '''Returns whether the named engine keeps V for lanes lanes within
+       max_memory bytes (the python engine trades time for memory instead).'''
+
+    return engine == 'python' or max_memory is None or engine_memory(engine, lanes, r, N) <= max_memory
+
+
+def _select_fitting(lanes, r, N, scratchpad, max_memory):
+    'Returns select_engine\'s engine, or python if it would exceed max_memory.'
+
+    engine = select_engine(lanes, scratchpad)
+    if not _fits(engine, lanes, r, N, max_memory):
+        return 'python'
+    return engine
+
+
+def smix_lanes(data, r, N, engine = 'python', scratchpad = None, max_memory = None):
+    '''Runs SMix over each consecutive 128 * r byte lane of data and returns
+       the resulting bytes, using the named ROMix engine. scratchpad selects
+       where V is kept and max_memory limits its size (see hash).'''
+
+    # The multi-lane engines keep V for every lane at once, in full
+    if not _fits(engine, len(data) // (128 * r), r, N, max_memory):
+        raise ValueError('The %s engine cannot keep V within max_memory' % engine)
+
+    if engine == 'numpy':
+        numpy_engine = _load_numpy_engine()
+        if numpy_engine is None:
+            raise ValueError('The numpy engine requires NumPy')
+        return numpy_engine.smix_lanes(data, r, N, scratchpad)
+
+    if engine == 'swar':
+        if scratchpad is not None:
+            raise ValueError('The swar engine does not support scratchpad')
+        return hash_swar.smix_lanes(data, r, N)
+
+    if engine != 'python':
+        raise ValueError('Unknown engine %r' % engine)
+
+    # convert into (little-endian) 32-bit words
+    words = len(data) // 4
+    B = array.array(WORD, struct.unpack('<%dI' % words, data))
+
+    # V holds every interval-th block (all of them, unless limited)
+    interval = tmto_interval(N, r, max_memory)
+    blocks = (N + interval - 1) // interval
+    T = None
+    if interval > 1:
+        T = array.array(WORD, [ 0 ]) * (64 * r)
+
+    if scratchpad is None:
+        (V, XY) = arena.acquire(blocks, r, WORD)
+        for i in xrange(0, words // (32 * r)):
+            smix(B, i * 32 * r, r, N, V, XY, interval, T)
+        arena.give_back(blocks, r, V, XY)
+
+    else:
+        XY = array.array(WORD, [ 0 ]) * (64 * r)
+        with open_scratchpad(XY.itemsize * 32 * r * blocks, scratchpad) as pad:
+            V = pad.words(WORD)
+            try:
+                for i in xrange(0, words // (32 * r)):
+                    smix(B, i * 32 * r, r, N, V, XY, interval, T)
+            finally:
+                del V
+
+    # Convert back into bytes
+    return struct.pack('<%dI' % words, *B)
+
+
+def set_executor(executor):
+    '''Sets the concurrent.futures executor used to run SMix lanes in
+       parallel (see hash's workers); None restores the default, a pool
+       created on first use for each number of workers.'''
+
+    global _executor
+    _executor = executor
+
+
+def _get_executor(workers):
+    'Returns the executor to run SMix lanes on for workers workers.'
+
+    if _executor is not None:
+        return _executor
+
+    if workers not in _executors:
+        import concurrent.futures
+
+        # Free-threaded builds can run lanes in threads, which avoids
+        # copying the lanes to and from worker processes
+        if not getattr(sys, '_is_gil_enabled', lambda: True)():
+            _executors[workers] = concurrent.futures.ThreadPoolExecutor(max_workers = workers)
+        else:
+            _executors[workers] = concurrent.futures.ProcessPoolExecutor(max_workers = workers)
+
+    return _executors[workers]
+
+
+def smix_lanes_parallel(data, r, N, engine, workers, scratchpad = None, max_memory = None):
+    '''Runs SMix over each lane of data like smix_lanes, spreading the lanes
+       across workers workers. Each worker allocates its own scratchpad, and
+       the results are reassembled in lane order.'''
+
+    lane_size = 128 * r
+    lanes = len(data) // lane_size
+
+    # Split the lanes as evenly as possible across the workers
+    per_worker = (lanes + workers - 1) // workers
+    chunks = [ data[i:i + per_worker * lane_size] for i in xrange(0, len(data), per_worker * lane_size) ]
+
+    if engine is None:
+        engines = [ _select_fitting(len(c) // lane_size, r, N, scratchpad, max_memory) for c in chunks ]
+    else:
+        engines = [ engine ] * len(chunks)
+
+    executor = _get_executor(workers)
+    results = executor.map(smix_lanes, chunks, [ r ] * len(chunks), [ N ] * len(chunks), engines,
+                           [ scratchpad ] * len(chunks), [ max_memory ] * len(chunks))
+
+    return b''.join(results)
+
+
+def hash_python(password, salt, N, r, p, dkLen, engine = None, workers = None, scratchpad = None, max_memory = None):
+    '''The pure-Python scrypt implementation (the "python" backend); see hash
+       for the parameters.'''
+
+    started = instrument.start()
+    kdf = PBKDF2(password)
+    B = kdf.derive(salt, p * 128 * r)
+    instrument.report('hash.pbkdf2', started, bytes = len(B), blocks = (len(B) + 31) // 32)
+
+    if workers is not None and workers > 1 and p > 1:
+        B = smix_lanes_parallel(B, r, N, engine, min(workers, p), scratchpad, max_memory)
+    else:
+        if engine is None:
+            engine = _select_fitting(p, r, N, scratchpad, max_memory)
+        B = smix_lanes(B, r, N, engine, scratchpad, max_memory)
+
+    started = instrument.start()
+    key = kdf.derive(B, dkLen)
+    instrument.report('hash.pbkdf2.final', started, bytes = dkLen, blocks = (dkLen + 31) // 32)
+
+    return key
+
+
+def check_parameters(password, salt, N):
+    'Raises a ValueError if the password, salt or N are invalid.'
 
     # This only matters to Python 3
     if not check_bytes(password):
@@ -234,25 +668,178 @@ def hash(password, salt, N, r, p, dkLen):
     # Scrypt implementation. Significant thanks to https://github.com/wg/scrypt
     if N < 2 or (N & (N - 1)): raise ValueError('Scrypt N must be a power of 2 greater than 1')
 
-    # A psuedorandom function
-    prf = lambda k, m: hmac.new(key = k, msg = m, digestmod = hashlib.sha256).digest()
 
-    # convert into integers
-    B  = [ get_byte(c) for c in pbkdf2_single(password, salt, p * 128 * r, prf) ]
-    B = [ ((B[i + 3] << 24) | (B[i + 2] << 16) | (B[i + 1] << 8) | B[i + 0]) for i in xrange(0, len(B), 4)]
+def derive(password, salt, N, r, p, dkLen, backend = None, cache = None, max_memory = None):
+    '''Returns a tuple (key, backend_name) of the scrypt derived key (see
+       hash) and the name of the backend which computed it; the name is
+       "cache" if the key came from cache.'''
 
-    XY = [ 0 ] * (64 * r)
-    V  = [ 0 ] * (32 * r * N)
+    check_parameters(password, salt, N)
 
-    for i in xrange(0, p):
-        smix(B, i * 32 * r, r, N, V, XY)
+    if cache is not None:
+        key = cache.get(password, salt, N, r, p, dkLen)
+        if key is not None:
+            return (key, 'cache')
 
-    # Convert back into bytes
-    Bc = [ ]
-    for i in B:
-        Bc.append((i >> 0) & 0xff)
-        Bc.append((i >> 8) & 0xff)
-        Bc.append((i >> 16) & 0xff)
-        Bc.append((i >> 24) & 0xff)
-
-    return pbkdf2_single(password, chars_to_bytes(Bc), dkLen, prf)
+    # Only the python backend can compute V within less than its full size
+    if max_memory is not None and 128 * r * N > max_memory:
+        if backend not in (None, 'python'):
+            raise ValueError('max_memory below 128 * r * N bytes requires the python backend')
+        backend = 'python'
+
+    name = select_backend(N, r, p, dkLen, backend)
+
+    # The python backend reports its own phases
+    started = None
+    if name != 'python':
+        started = instrument.start()
+    if name == 'python' and max_memory is not None:
+        key = hash_python(password, salt, N, r, p, dkLen, max_memory = max_memory)
+    else:
+        key = get_backend(name).function(password, salt, N, r, p, dkLen)
+    instrument.report('hash.backend', started, bytes = 128 * r * N * p, blocks = 2 * N * p)
+
+    if cache is not None:
+        cache.put(password, salt, N, r, p, dkLen, key)
+
+    return (key, name)
+
+
+def hash(password, salt, N, r, p, dkLen, engine = None, workers = None, backend = None, cache = None, scratchpad = None, max_memory = None):
+    """Returns the result of the scrypt password-based key derivation function.
+
+       Constraints:
+         r * p < (2 ** 30)
+         dkLen <= (((2 ** 32) - 1) * 32
+         N must be a power of 2 greater than 1 (eg. 2, 4, 8, 16, 32...)
+         N, r, p must be positive
+
+       engine selects the ROMix implementation ("python", "swar" or
+       "numpy"); by default NumPy (if it is installed) is used once p is at
+       least NUMPY_MIN_LANES, otherwise the pure-Python engine. The SWAR
+       engine is faster for a few lanes but uses several times the memory,
+       so is only used when selected.
+
+       workers, if greater than 1, runs the p independent SMix lanes across
+       that many worker processes (threads on free-threaded builds), or
+       across the executor passed to set_executor.
+
+       backend forces a key derivation backend (see backend.py); by default
+       the fastest available is used (e.g. hashlib.scrypt, when present).
+       The engine and workers options imply the "python" backend; use
+       derive to also learn which backend computed the key.
+
+       cache, a DerivedKeyCache, is consulted before deriving the key and
+       updated afterwards.
+
+       scratchpad, for very large N, keeps ROMix's V (128 * r * N bytes) in
+       a memory map; "mmap" for an anonymous mapping, or the path of a
+       directory for a file-backed one (see scratchpad.py). It is zeroed
+       and removed once the key is derived.
+
+       max_memory, in bytes, limits the size of V for hosts that cannot
+       afford 128 * r * N bytes; only every k-th block of V is kept (for the
+       smallest k that fits) and the rest are recomputed as they are needed,
+       for about k / 2 times the work. The key is unchanged. This requires
+       the python backend (and engine, for V that does not fit).
+     """
+
+    # The ROMix options only apply to the pure-Python backend
+    if engine is not None or workers is not None or scratchpad is not None:
+        if backend not in (None, 'python'):
+            raise ValueError('engine, workers and scratchpad require the python backend')
+        check_parameters(password, salt, N)
+
+        if cache is not None:
+            key = cache.get(password, salt, N, r, p, dkLen)
+            if key is not None:
+                return key
+
+        key = hash_python(password, salt, N, r, p, dkLen, engine, workers, scratchpad, max_memory)
+
+        if cache is not None:
+            cache.put(password, salt, N, r, p, dkLen, key)
+
+        return key
+
+    return derive(password, salt, N, r, p, dkLen, backend, cache, max_memory)[0]
+
+
+def _batch_size(engine, count, r, N, p, max_memory):
+    '''Returns the most of count passwords (at least one) whose p lanes each
+       the named engine can run together within max_memory bytes.'''
+
+    if _fits(engine, count * p, r, N, max_memory):
+        return count
+
+    # The engine's memory grows with the lanes; find the largest that fits
+    (low, high) = (1, count - 1)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if _fits(engine, middle * p, r, N, max_memory):
+            low = middle
+        else:
+            high = middle - 1
+
+    return low
+
+
+def hash_many(passwords, salts, N, r, p, dkLen, engine = None, max_memory = HASH_MANY_MAX_MEMORY, backend = None):
+    """Returns a list of the scrypt derived keys for each (password, salt)
+       pair, in input order; the same as calling hash() for each pair.
+
+       The SMix lanes of every password are stacked into one buffer and run
+       through ROMix together, so the per-call overhead is shared across the
+       batch. The number of passwords computed at once is limited so the
+       engine's scratchpad stays within max_memory bytes (at least one
+       password is always computed at a time); None means no limit.
+
+       If the selected backend is not "python" (see hash), the batch is
+       simply computed one password at a time by that backend.
+     """
+
+    passwords = list(passwords)
+    salts = list(salts)
+
+    if len(passwords) != len(salts):
+        raise ValueError('passwords and salts must be the same length')
+
+    for (password, salt) in zip(passwords, salts):
+        check_parameters(password, salt, N)
+
+    # Another backend (e.g. hashlib) is faster one at a time than in lockstep
+    if engine is None and select_backend(N, r, p, dkLen, backend) != 'python':
+        return [ derive(password, salt, N, r, p, dkLen, backend)[0] for (password, salt) in zip(passwords, salts) ]
+
+    # How many passwords fit in a batch (the multi-lane engines keep a
+    # scratchpad for every lane; the python engine reuses one, so memory is
+    # not a concern)
+    batch_engine = engine
+    if batch_engine is None:
+        batch_engine = select_engine(len(passwords) * p)
+    batch_size = _batch_size(batch_engine, max(1, len(passwords)), r, N, p, max_memory)
+
+    results = [ ]
+    for start in xrange(0, len(passwords), batch_size):
+        batch = list(zip(passwords[start:start + batch_size], salts[start:start + batch_size]))
+
+        # A smaller batch may not pay off (or fit) with the multi-lane engine
+        batch_engine = engine
+        if batch_engine is None:
+            batch_engine = _select_fitting(len(batch) * p, r, N, None, max_memory)
+
+        # Stack every lane of every password in the batch into one buffer
+        kdfs = [ PBKDF2(password) for (password, salt) in batch ]
+        B = bytearray(len(batch) * p * 128 * r)
+        for (i, (kdf, (password, salt))) in enumerate(zip(kdfs, batch)):
+            kdf.derive_into(salt, memoryview(B)[i * p * 128 * r:(i + 1) * p * 128 * r])
+        B = smix_lanes(bytes(B), r, N, batch_engine)
+
+        for (i, kdf) in enumerate(kdfs):
+            lanes = B[i * p * 128 * r:(i + 1) * p * 128 * r]
+            results.append(kdf.derive(lanes, dkLen))
+
+    return results
+
+
+register_backend('python', hash_python, priority = 0)
@@ -0,0 +1,163 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2014 Richard Moore
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+# NumPy ROMix engine; an optional drop-in for smix in hash.py.
+#
+# Every independent SMix lane (the p lanes of a single hash) is processed at
+# the same time; B, X and V are uint32 arrays and each Salsa20/8 step, the
+# XOR against V[j] and the BlockMix shuffle are whole-array operations.
+#
+# The 16 words of each Salsa20 block are kept in "diagonal" order for the
+# entire computation:
+#
+#    a = (0, 5, 10, 15)   b = (4, 9, 14, 3)   c = (8, 13, 2, 7)   d = (12, 1, 6, 11)
+#
+# which turns each of the column rounds into four whole-row operations, and
+# the row rounds into the same operations on rotated rows. BlockMix and
+# ROMix only ever combine words at the same position, so the order does not
+# matter to them; word 0 (used to select V[j]) stays at position 0.
+
+import numpy
+
+from . import instrument
+from .scratchpad import open_scratchpad
+
+
+# Word order used for the state (see above), and its inverse
+DIAGONAL = numpy.array([0, 5, 10, 15, 4, 9, 14, 3, 8, 13, 2, 7, 12, 1, 6, 11])
+UNDIAGONAL = numpy.argsort(DIAGONAL)
+
+# Row rotations used to line the rows up for the row rounds
+ROTATE_1 = numpy.array([3, 0, 1, 2])
+ROTATE_2 = numpy.array([2, 3, 0, 1])
+ROTATE_3 = numpy.array([1, 2, 3, 0])
+
+
+def salsa20_8(x):
+    '''Salsa 20/8 over every lane at once; x is a (lanes, 16) uint32 array in
+       diagonal order and is updated in place.'''
+
+    a = x[:, 0:4].copy()
+    b = x[:, 4:8].copy()
+    c = x[:, 8:12].copy()
+    d = x[:, 12:16].copy()
+
+    t = numpy.empty_like(a)
+    u = numpy.empty_like(a)
+
+    for i in (8, 6, 4, 2):
+
+        # Column round
+        numpy.add(a, d, out = t); numpy.left_shift(t, 7, out = u); t >>= 25; u |= t; b ^= u
+        numpy.add(b, a, out = t); numpy.left_shift(t, 9, out = u); t >>= 23; u |= t; c ^= u
+        numpy.add(c, b, out = t); numpy.left_shift(t, 13, out = u); t >>= 19; u |= t; d ^= u
+        numpy.add(d, c, out = t); numpy.left_shift(t, 18, out = u); t >>= 14; u |= t; a ^= u
+
+        # Row round
+        b = b[:, ROTATE_1]
+        c = c[:, ROTATE_2]
+        d = d[:, ROTATE_3]
+
+        numpy.add(a, b, out = t); numpy.left_shift(t, 7, out = u); t >>= 25; u |= t; d ^= u
+        numpy.add(d, a, out = t); numpy.left_shift(t, 9, out = u); t >>= 23; u |= t; c ^= u
+        numpy.add(c, d, out = t); numpy.left_shift(t, 13, out = u); t >>= 19; u |= t; b ^= u
+        numpy.add(b, c, out = t); numpy.left_shift(t, 18, out = u); t >>= 14; u |= t; a ^= u
+
+        b = b[:, ROTATE_3]
+        c = c[:, ROTATE_2]
+        d = d[:, ROTATE_1]
+
+    # Add the original values
+    x[:, 0:4] += a
+    x[:, 4:8] += b
+    x[:, 8:12] += c
+    x[:, 12:16] += d
+
+
+def blockmix_salsa8(B, Y, r):
+    '''Blockmix; B is a (lanes, 2 * r, 16) array, the result is placed in Y.
+
+       The even/odd shuffle (BlockMix - 6) is done by writing each sub-block
+       straight to its final position.'''
+
+    X = B[:, 2 * r - 1].copy()                                    # BlockMix - 1
+
+    for i in range(0, 2 * r):                                     # BlockMix - 2
+        X ^= B[:, i]                                              # BlockMix - 3(inner)
+        salsa20_8(X)                                              # BlockMix - 3(outer)
+        Y[:, (i // 2) + (i % 2) * r] = X                          # BlockMix - 4, 6
+
+
+def smix(B, r, N, V = None):
+    '''SMix over every lane of B, a (lanes, 2 * r, 16) array in diagonal
+       order. Returns the resulting array. V, if given, is the (N, lanes,
+       2 * r, 16) uint32 scratchpad to use.'''
+
+    lanes = B.shape[0]
+    lane_index = numpy.arange(lanes)
+
+    X = B.copy()                                     # ROMix - 1
+    Y = numpy.empty_like(X)
+    if V is None:
+        V = numpy.empty((N, ) + X.shape, dtype = numpy.uint32)
+
+    started = instrument.start()
+    for i in range(0, N):                            # ROMix - 2
+        V[i] = X                                     # ROMix - 3
+        blockmix_salsa8(X, Y, r)                     # ROMix - 4
+        (X, Y) = (Y, X)
+    instrument.report('hash.romix.fill', started, bytes = X.nbytes * N, blocks = N * lanes)
+
+    started = instrument.start()
+    for i in range(0, N):                            # ROMix - 6
+        j = X[:, 2 * r - 1, 0] & (N - 1)             # ROMix - 7
+        X ^= V[j, lane_index]                        # ROMix - 8(inner)
+        blockmix_salsa8(X, Y, r)                     # ROMix - 9(outer)
+        (X, Y) = (Y, X)
+    instrument.report('hash.romix.mix', started, bytes = X.nbytes * N, blocks = N * lanes)
+
+    return X                                         # ROMix - 10
+
+
+def smix_lanes(data, r, N, scratchpad = None):
+    '''Runs SMix over each consecutive 128 * r byte lane of data (a byte
+       string of little-endian words) and returns the result as bytes.
+       scratchpad selects where V is kept (see hash).'''
+
+    B = numpy.frombuffer(data, dtype = '<u4').astype(numpy.uint32)
+    B = B.reshape(-1, 2 * r, 16)[:, :, DIAGONAL]
+
+    if scratchpad is None:
+        X = smix(B, r, N)
+
+    else:
+        with open_scratchpad(B.nbytes * N, scratchpad) as pad:
+            V = numpy.frombuffer(pad.buffer, dtype = numpy.uint32).reshape((N, ) + B.shape)
+            try:
+                X = smix(B, r, N, V)
+
+            # The mapping cannot be closed while an array refers to it
+            finally:
+                del V
+
+    return X[:, :, UNDIAGONAL].astype('<u4').tobytes()
@@ -0,0 +1,259 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2014 Richard Moore
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+# SWAR ("SIMD within a register") ROMix engine; a dependency-free drop-in
+# for smix in hash.py, for when NumPy is not available.
+#
+# The same word of every independent SMix lane is packed into one Python
+# int, with each lane in its own 64-bit slot (32 bits of data above 32 guard
+# bits). A single big-int add, shift, or, xor or mask then performs that
+# step of Salsa20/8 for every lane at once:
+#
+#    slot:     | guard (32) | word (32) | guard (32) | word (32) | ...
+#                              lane 1                   lane 0
+#
+# Additions carry at most one bit into the guard bits, and shifts move bits
+# at most 32 positions, so masking with M (the word bits of every slot)
+# after each addition and rotation keeps the lanes apart.
+
+import struct
+import sys
+
+
+# Python 3 doesn't have xrange
+try:
+    xrange
+except NameError:
+    xrange = range
+
+
+# Bits per lane slot
+SLOT = 64
+
+# The most lanes packed together; gathering V[j] for every lane costs a
+# pass over V[j] per lane, so wider packs lose more than they gain
+MAX_LANES = 64
+
+
+def lane_masks(lanes):
+    '''Returns (M, masks); M selects the word bits of every slot, and
+       masks[l] the word bits of lane l's slot.'''
+
+    masks = [ 0xffffffff << (SLOT * l) for l in xrange(0, lanes) ]
+    return (sum(masks), masks)
+
+
+def salsa20_8(X, B, M):
+    '''Salsa 20/8 over every lane at once; returns Salsa20/8(X ^ B) as a new
+       list of 16 packed words (X and B are lists of 16 packed words).'''
+
+    x0 = j0 = X[0] ^ B[0]
+    x1 = j1 = X[1] ^ B[1]
+    x2 = j2 = X[2] ^ B[2]
+    x3 = j3 = X[3] ^ B[3]
+    x4 = j4 = X[4] ^ B[4]
+    x5 = j5 = X[5] ^ B[5]
+    x6 = j6 = X[6] ^ B[6]
+    x7 = j7 = X[7] ^ B[7]
+    x8 = j8 = X[8] ^ B[8]
+    x9 = j9 = X[9] ^ B[9]
+    x10 = j10 = X[10] ^ B[10]
+    x11 = j11 = X[11] ^ B[11]
+    x12 = j12 = X[12] ^ B[12]
+    x13 = j13 = X[13] ^ B[13]
+    x14 = j14 = X[14] ^ B[14]
+    x15 = j15 = X[15] ^ B[15]
+
+    # See salsa20_8 in hash.py for the unrolled rounds; every rotation is
+    # masked here, as the bits shifted right come from the next lane's slot
+    for i in (8, 6, 4, 2):
+        a = (x0 + x12) & M
+        x4 ^= ((a << 7) | (a >> 25)) & M
+        a = (x4 + x0) & M
+        x8 ^= ((a << 9) | (a >> 23)) & M
+        a = (x8 + x4) & M
+        x12 ^= ((a << 13) | (a >> 19)) & M
+        a = (x12 + x8) & M
+        x0 ^= ((a << 18) | (a >> 14)) & M
+        a = (x5 + x1) & M
+        x9 ^= ((a << 7) | (a >> 25)) & M
+        a = (x9 + x5) & M
+        x13 ^= ((a << 9) | (a >> 23)) & M
+        a = (x13 + x9) & M
+        x1 ^= ((a << 13) | (a >> 19)) & M
+        a = (x1 + x13) & M
+        x5 ^= ((a << 18) | (a >> 14)) & M
+        a = (x10 + x6) & M
+        x14 ^= ((a << 7) | (a >> 25)) & M
+        a = (x14 + x10) & M
+        x2 ^= ((a << 9) | (a >> 23)) & M
+        a = (x2 + x14) & M
+        x6 ^= ((a << 13) | (a >> 19)) & M
+        a = (x6 + x2) & M
+        x10 ^= ((a << 18) | (a >> 14)) & M
+        a = (x15 + x11) & M
+        x3 ^= ((a << 7) | (a >> 25)) & M
+        a = (x3 + x15) & M
+        x7 ^= ((a << 9) | (a >> 23)) & M
+        a = (x7 + x3) & M
+        x11 ^= ((a << 13) | (a >> 19)) & M
+        a = (x11 + x7) & M
+        x15 ^= ((a << 18) | (a >> 14)) & M
+        a = (x0 + x3) & M
+        x1 ^= ((a << 7) | (a >> 25)) & M
+        a = (x1 + x0) & M
+        x2 ^= ((a << 9) | (a >> 23)) & M
+        a = (x2 + x1) & M
+        x3 ^= ((a << 13) | (a >> 19)) & M
+        a = (x3 + x2) & M
+        x0 ^= ((a << 18) | (a >> 14)) & M
+        a = (x5 + x4) & M
+        x6 ^= ((a << 7) | (a >> 25)) & M
+        a = (x6 + x5) & M
+        x7 ^= ((a << 9) | (a >> 23)) & M
+        a = (x7 + x6) & M
+        x4 ^= ((a << 13) | (a >> 19)) & M
+        a = (x4 + x7) & M
+        x5 ^= ((a << 18) | (a >> 14)) & M
+        a = (x10 + x9) & M
+        x11 ^= ((a << 7) | (a >> 25)) & M
+        a = (x11 + x10) & M
+        x8 ^= ((a << 9) | (a >> 23)) & M
+        a = (x8 + x11) & M
+        x9 ^= ((a << 13) | (a >> 19)) & M
+        a = (x9 + x8) & M
+        x10 ^= ((a << 18) | (a >> 14)) & M
+        a = (x15 + x14) & M
+        x12 ^= ((a << 7) | (a >> 25)) & M
+        a = (x12 + x15) & M
+        x13 ^= ((a << 9) | (a >> 23)) & M
+        a = (x13 + x12) & M
+        x14 ^= ((a << 13) | (a >> 19)) & M
+        a = (x14 + x13) & M
+        x15 ^= ((a << 18) | (a >> 14)) & M
+
+    # Add the original values
+    return [
+        (j0 + x0) & M,
+        (j1 + x1) & M,
+        (j2 + x2) & M,
+        (j3 + x3) & M,
+        (j4 + x4) & M,
+        (j5 + x5) & M,
+        (j6 + x6) & M,
+        (j7 + x7) & M,
+        (j8 + x8) & M,
+        (j9 + x9) & M,
+        (j10 + x10) & M,
+        (j11 + x11) & M,
+        (j12 + x12) & M,
+        (j13 + x13) & M,
+        (j14 + x14) & M,
+        (j15 + x15) & M,
+    ]
+
+
+def blockmix_salsa8(B, r, M):
+    '''BlockMix over every lane at once; B is a list of 32 * r packed words.
+       Returns the result as a new list.'''
+
+    X = B[(2 * r - 1) * 16:]                                      # BlockMix - 1
+    Y = [ None ] * (2 * r)
+
+    for i in xrange(0, 2 * r):                                    # BlockMix - 2
+        X = salsa20_8(X, B[i * 16:(i + 1) * 16], M)               # BlockMix - 3
+        Y[(i // 2) + (i % 2) * r] = X                             # BlockMix - 4, 6
+
+    return [ word for block in Y for word in block ]
+
+
+def smix(B, r, N, lanes):
+    '''SMix over every lane of B, a list of 32 * r words each packing lanes
+       lanes. Returns the resulting list.'''
+
+    (M, masks) = lane_masks(lanes)
+    shifts = [ SLOT * l for l in xrange(0, lanes) ]
+    last = (2 * r - 1) * 16
+
+    X = B                                            # ROMix - 1
+    V = [ None ] * N
+
+    for i in xrange(0, N):                           # ROMix - 2
+        V[i] = X                                     # ROMix - 3
+        X = blockmix_salsa8(X, r, M)                 # ROMix - 4
+
+    for i in xrange(0, N):                           # ROMix - 6
+        word = X[last]
+
+        if lanes == 1:
+            T = V[word & (N - 1)]                    # ROMix - 7
+
+        # Each lane reads its own V[j]; gather lane l's slot from V[j_l]
+        else:
+            Vj = [ V[(word >> s) & (N - 1)] for s in shifts ]
+            T = [ 0 ] * (32 * r)
+            for (l, mask) in enumerate(masks):
+                Vl = Vj[l]
+                T = [ t | (v & mask) for (t, v) in zip(T, Vl) ]
+
+        X = blockmix_salsa8([ x ^ t for (x, t) in zip(X, T) ], r, M)  # ROMix - 8, 9
+
+    return X                                         # ROMix - 10
+
+
+def memory(lanes, r, N):
+    '''Returns (an estimate of) the bytes V takes for lanes lanes; each of
+       its N blocks is a list of 32 * r ints of up to SLOT bits per lane.'''
+
+    lanes = min(lanes, MAX_LANES)
+    block = sys.getsizeof([ None ] * (32 * r)) + 32 * r * sys.getsizeof((1 << (SLOT * lanes)) - 1)
+    return sys.getsizeof([ None ] * N) + N * block
+
+
+def smix_lanes(data, r, N):
+    '''Runs SMix over each consecutive 128 * r byte lane of data (a byte
+       string of little-endian words) and returns the result as bytes.'''
+
+    words = 32 * r
+    lane_count = len(data) // (4 * words)
+    W = struct.unpack('<%dI' % (lane_count * words), data)
+
+    result = [ ]
+    for start in xrange(0, lane_count, MAX_LANES):
+        lanes = min(MAX_LANES, lane_count - start)
+
+        # Pack word w of every lane into one int
+        B = [ 0 ] * words
+        for l in xrange(0, lanes):
+            shift = SLOT * l
+            offset = (start + l) * words
+            B = [ b | (w << shift) for (b, w) in zip(B, W[offset:offset + words]) ]
+
+        X = smix(B, r, N, lanes)
+
+        # Unpack each lane
+        for l in xrange(0, lanes):
+            shift = SLOT * l
+            result.extend((x >> shift) & 0xffffffff for x in X)
+
+    return struct.pack('<%dI' % len(result), *result)
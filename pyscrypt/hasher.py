@@ -0,0 +1,195 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2014 Richard Moore
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+# A resumable, step-wise scrypt computation (using the pure-Python engine),
+# so long key derivations can report progress, be time-sliced with other
+# work (e.g. an event loop or UI) and be cancelled.
+#
+#    hasher = ScryptHasher(password, salt, N, r, p, dkLen, callback = report)
+#    for progress in hasher.steps(256):
+#        ... do other work; call hasher.cancel() to give up ...
+#    key = hasher.digest()
+#
+# Each step is a number of BlockMix calls; there are 2 * N * p in total (a
+# fill and a mix loop of N for each of the p lanes).
+
+import array
+import struct
+
+from .hash import PBKDF2, WORD, check_parameters, smix_fill, smix_mix
+
+
+# Python 3 doesn't have xrange
+try:
+    xrange
+except NameError:
+    xrange = range
+
+
+# BlockMix calls per step by default
+DEFAULT_ITERATIONS = 256
+
+
+class ScryptCancelled(Exception): pass
+
+
+class ScryptHasher(object):
+
+    def __init__(self, password, salt, N, r, p, dkLen, callback = None):
+        '''Prepares the scrypt derived key computation; see pyscrypt.hash for
+           the parameters. callback, if given, is called with the fraction
+           complete (0.0 to 1.0) after each step.'''
+
+        check_parameters(password, salt, N)
+
+        self._kdf = PBKDF2(password)
+        self._N = N
+        self._r = r
+        self._p = p
+        self._dkLen = dkLen
+        self._callback = callback
+
+        # The initial PBKDF2 output, as words
+        B = self._kdf.derive(salt, p * 128 * r)
+        self._B = array.array(WORD, struct.unpack('<%dI' % (len(B) // 4), B))
+
+        self._X = array.array(WORD, [ 0 ]) * (64 * r)
+        self._V = array.array(WORD, [ 0 ]) * (32 * r * N)
+
+        # Position; the lane, the loop (0 = fill, 1 = mix) and the iteration
+        self._lane = 0
+        self._loop = 0
+        self._index = 0
+        self._Xi = 0
+
+        self._completed = 0
+        self._total = 2 * N * p
+
+        self._cancelled = False
+        self._key = None
+
+    N = property(lambda s: s._N)
+    r = property(lambda s: s._r)
+    p = property(lambda s: s._p)
+    dkLen = property(lambda s: s._dkLen)
+
+    # BlockMix calls completed and required
+    completed = property(lambda s: s._completed)
+    total = property(lambda s: s._total)
+
+    done = property(lambda s: s._key is not None)
+    cancelled = property(lambda s: s._cancelled)
+
+    @property
+    def progress(self):
+        'The fraction of the computation complete (0.0 to 1.0).'
+
+        if self._key is not None:
+            return 1.0
+        return float(self._completed) / self._total
+
+    def cancel(self):
+        '''Cancels the computation; the next call to step raises ScryptCancelled
+           and the scratchpad is released.'''
+
+        self._cancelled = True
+
+    def step(self, iterations = DEFAULT_ITERATIONS):
+        '''Performs up to iterations BlockMix calls, returning True once the
+           derived key is available.'''
+
+        if self._cancelled:
+            self._release()
+            raise ScryptCancelled('scrypt computation cancelled')
+
+        if self._key is not None:
+            return True
+
+        (r, N) = (self._r, self._N)
+        words = 32 * r
+
+        while iterations > 0 and self._lane < self._p:
+            count = min(iterations, N - self._index)
+
+            if self._loop == 0:
+
+                # Starting a lane; ROMix - 1
+                if self._index == 0:
+                    Bi = self._lane * words
+                    self._X[0:words] = self._B[Bi:Bi + words]
+                    self._Xi = 0
+
+                self._Xi = smix_fill(self._X, self._Xi, self._V, r, self._index, self._index + count)
+
+            else:
+                self._Xi = smix_mix(self._X, self._Xi, self._V, r, N, count)
+
+            self._index += count
+            self._completed += count
+            iterations -= count
+
+            if self._index == N:
+                self._index = 0
+
+                if self._loop == 0:
+                    self._loop = 1
+
+                # Finished a lane; ROMix - 10
+                else:
+                    Bi = self._lane * words
+                    self._B[Bi:Bi + words] = self._X[self._Xi:self._Xi + words]
+                    self._lane += 1
+                    self._loop = 0
+
+        if self._lane == self._p:
+            B = struct.pack('<%dI' % len(self._B), *self._B)
+            self._key = self._kdf.derive(B, self._dkLen)
+            self._release()
+
+        if self._callback is not None:
+            self._callback(self.progress)
+
+        return self._key is not None
+
+    def steps(self, iterations = DEFAULT_ITERATIONS):
+        'Generator which performs a step at a time, yielding the progress after each.'
+
+        while not self.step(iterations):
+            yield self.progress
+        yield 1.0
+
+    def __iter__(self):
+        return self.steps()
+
+    def digest(self):
+        'Returns the derived key, completing any remaining steps first.'
+
+        while not self.step(self._total):
+            pass
+        return self._key
+
+    def _release(self):
+        'Releases the buffers (and password) once they are no longer needed.'
+
+        self._B = self._X = self._V = None
+        self._kdf = None
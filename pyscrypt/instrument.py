@@ -0,0 +1,156 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2014 Richard Moore
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+# Optional instrumentation; per-phase durations, byte counts and block counts
+# reported by hash, AESCounterModeOfOperation and ScryptFile.
+#
+#    stats = pyscrypt.instrument.Stats()
+#    pyscrypt.instrument.add_hook(stats)
+#    ... work ...
+#    print(stats.snapshot())
+#
+# A hook is any callable hook(phase, seconds, bytes, blocks). The phases are:
+#
+#    hash.pbkdf2          - the initial PBKDF2 expansion
+#    hash.romix.fill      - ROMix steps 1 - 5 (filling V), for every lane
+#    hash.romix.mix       - ROMix steps 6 - 10, for every lane
+#    hash.pbkdf2.final    - the final PBKDF2
+#    hash.backend         - an entire derivation by another backend (e.g. hashlib)
+#    aes.keystream        - AES-CTR keystream generation (blocks = AES blocks)
+#    aes.xor              - combining the keystream with the data
+#    aes.parallel         - an encrypt split across worker processes
+#    file.header          - ScryptFile._read_header (including the derivation)
+#    file.io.read         - reads from the underlying file object
+#    file.io.write        - writes to the underlying file object
+#    file.hmac            - the stream HMAC
+#    file.read            - an entire ScryptFile.read call
+#    file.write           - an entire ScryptFile.write call
+#    file.finalize        - ScryptFile._finalize_write
+#
+# With no hooks installed, the instrumented code only tests enabled, so it
+# costs nothing measurable.
+
+import threading
+import time
+
+
+# True while any hook is installed; checked before taking any timings
+enabled = False
+
+# The clock used for the timings
+clock = getattr(time, 'perf_counter', time.time)
+
+_hooks = [ ]
+_lock = threading.Lock()
+
+
+def add_hook(hook):
+    'Installs hook, called as hook(phase, seconds, bytes, blocks) for each phase.'
+
+    global enabled, _hooks
+
+    with _lock:
+        _hooks = _hooks + [ hook ]
+        enabled = True
+
+
+def remove_hook(hook):
+    'Removes a hook installed by add_hook.'
+
+    global enabled, _hooks
+
+    with _lock:
+        hooks = list(_hooks)
+        hooks.remove(hook)
+        _hooks = hooks
+        enabled = bool(hooks)
+
+
+def start():
+    'Returns the start time for a phase, or None if instrumentation is disabled.'
+
+    if enabled:
+        return clock()
+    return None
+
+
+def report(phase, started, bytes = 0, blocks = 0):
+    '''Reports a phase to every hook; started is the value returned by start
+       (None, when disabled, reports nothing).'''
+
+    if started is None:
+        return
+
+    seconds = clock() - started
+    for hook in _hooks:
+        hook(phase, seconds, bytes, blocks)
+
+
+class Stats(object):
+    '''A hook which accumulates the count, seconds, bytes and blocks of each
+       phase.'''
+
+    def __init__(self):
+        self._phases = { }
+        self._lock = threading.Lock()
+
+    def __call__(self, phase, seconds, bytes, blocks):
+        with self._lock:
+            totals = self._phases.get(phase)
+            if totals is None:
+                totals = self._phases[phase] = [ 0, 0.0, 0, 0 ]
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] += bytes
+            totals[3] += blocks
+
+    def snapshot(self):
+        'Returns {phase: dict(count, seconds, bytes, blocks)}.'
+
+        with self._lock:
+            return dict((phase, dict(count = c, seconds = s, bytes = b, blocks = k))
+                        for (phase, (c, s, b, k)) in self._phases.items())
+
+    def reset(self):
+        'Discards everything accumulated so far.'
+
+        with self._lock:
+            self._phases = { }
+
+
+def metrics_hook(timing, counter = None, prefix = 'pyscrypt.'):
+    '''Returns a hook which feeds a metrics pipeline (e.g. a statsd client):
+       timing(name, milliseconds) for each phase and, if given,
+       counter(name + '.bytes', bytes) and counter(name + '.blocks', blocks)
+       for non-zero counts. Names are the phase with prefix prepended.'''
+
+    def hook(phase, seconds, bytes, blocks):
+        name = prefix + phase
+        timing(name, seconds * 1000.0)
+        if counter is not None:
+            if bytes:
+                counter(name + '.bytes', bytes)
+            if blocks:
+                counter(name + '.blocks', blocks)
+
+    return hook
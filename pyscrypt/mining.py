@@ -0,0 +1,118 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2014 Richard Moore
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+# Litecoin-style proof-of-work scanning (see nightminer, where this library
+# started); the proof-of-work hash of an 80 byte block header is
+#
+#    scrypt(header, header, N = 1024, r = 1, p = 1, dkLen = 32)
+#
+# where the last 4 bytes of the header are the (little-endian) nonce.
+#
+# The header is longer than the SHA256 block size, so HMAC first hashes it
+# down to a 32 byte key. The first 64 bytes of the header do not change with
+# the nonce, so the SHA256 state after them (the "midstate") is computed
+# once and copied for every nonce. The nonces are then hashed in batches;
+# with NumPy installed, the SMix lanes of a batch run side by side on its
+# multi-lane ROMix engine (otherwise the pure-Python engine runs them one
+# at a time).
+
+import binascii
+import hashlib
+import struct
+import time
+
+from .hash import PBKDF2, select_engine, smix_lanes
+
+
+# Litecoin's scrypt parameters
+N = 1024
+r = 1
+p = 1
+dkLen = 32
+
+# Nonces hashed together by the ROMix engine
+SCAN_BATCH = 64
+
+
+def hash_to_int(hash):
+    'Returns the proof-of-work hash as an integer (it is little-endian).'
+
+    return int(binascii.hexlify(hash[::-1]), 16)
+
+
+def scan_nonces(header76, start, count, target, engine = None, batch = SCAN_BATCH):
+    '''Hashes the 80 byte block headers header76 + nonce for nonce in start
+       through start + count - 1, returning (nonces, stats); nonces lists
+       those whose hash (as a little-endian integer) is at most target, and
+       stats is a dict of hashes, seconds and hashes_per_second.
+
+       engine selects the ROMix engine (see hash); by default that chosen by
+       select_engine for batch lanes, which is "numpy" (if it is installed)
+       for the default batch. Without NumPy, "swar" runs the lanes together
+       several times faster, at several times the memory.'''
+
+    if len(header76) != 76:
+        raise ValueError('header76 must be 76 bytes in length')
+    if start < 0 or count < 0 or start + count > (1 << 32):
+        raise ValueError('nonces must be 32-bit unsigned integers')
+
+    if engine is None:
+        engine = select_engine(min(batch, count))
+
+    started = time.time()
+
+    # The SHA256 midstate after the first 64 bytes of the header
+    midstate = hashlib.sha256(header76[:64])
+    tail = header76[64:]
+
+    found = [ ]
+    for first in range(start, start + count, batch):
+        nonces = range(first, min(first + batch, start + count))
+
+        headers = [ ]
+        kdfs = [ ]
+        for nonce in nonces:
+            header = header76 + struct.pack('<I', nonce)
+
+            # HMAC keys longer than a block are hashed first; do it from
+            # the midstate and key HMAC with the digest (the same thing)
+            key = midstate.copy()
+            key.update(tail + header[76:])
+
+            headers.append(header)
+            kdfs.append(PBKDF2(key.digest()))
+
+        # Run the SMix lane of every nonce in the batch together
+        B = b''.join(kdf.derive(header, p * 128 * r) for (kdf, header) in zip(kdfs, headers))
+        B = smix_lanes(B, r, N, engine)
+
+        for (i, nonce) in enumerate(nonces):
+            hash = kdfs[i].derive(B[i * 128 * r:(i + 1) * 128 * r], dkLen)
+            if hash_to_int(hash) <= target:
+                found.append(nonce)
+
+    seconds = time.time() - started
+    stats = dict(hashes = count, seconds = seconds,
+                 hashes_per_second = (count / seconds) if seconds > 0 else 0.0)
+
+    return (found, stats)
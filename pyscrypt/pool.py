@@ -0,0 +1,305 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2014 Richard Moore
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+# A persistent pool of hashing processes for fixed scrypt parameters (Python
+# 3 only), for servers which hash many passwords with the same N, r and p.
+#
+# Every worker is started up front and keeps its scratchpad (V and XY) for
+# the pool's parameters, so a hash only sends the password and salt and
+# receives the key. Workers can be recycled after a number of hashes; the
+# whole set is replaced at once (the old workers finish their queued hashes
+# and exit), as ProcessPoolExecutor's own max_tasks_per_child can deadlock
+# on some Python versions.
+#
+#    with HashPool(4, N = 16384, r = 8, p = 1) as pool:
+#        key = pool.submit(password, salt).result()
+
+import array
+import collections
+import concurrent.futures
+import struct
+import sys
+import threading
+import time
+
+from .backend import select_backend
+from .hash import PBKDF2, WORD, check_parameters, derive, select_engine, smix, smix_lanes
+
+
+# Request latencies kept for the percentiles in stats
+LATENCY_SAMPLES = 1024
+
+
+# The state of a worker process; set up by _worker_initialize
+_worker = None
+
+
+class _WorkerState(object):
+
+    def __init__(self, N, r, p, dkLen, backend):
+        self.N = N
+        self.r = r
+        self.p = p
+        self.dkLen = dkLen
+        self.backend = backend
+
+        # Preallocate the pure-Python engine's scratchpad once per process
+        self.engine = None
+        if backend == 'python':
+            self.engine = select_engine(p)
+            if self.engine == 'python':
+                self.XY = array.array(WORD, [ 0 ]) * (64 * r)
+                self.V  = array.array(WORD, [ 0 ]) * (32 * r * N)
+
+
+def _worker_initialize(N, r, p, dkLen, backend):
+    global _worker
+    _worker = _WorkerState(N, r, p, dkLen, backend)
+
+
+def _worker_ready():
+    'Returns once the worker process is running (used to start the workers up front).'
+
+    return True
+
+
+def _worker_hash(password, salt):
+    '''Returns (key, seconds) of the derived key for password and salt, and
+       the seconds it took within the worker.'''
+
+    started = time.time()
+    w = _worker
+
+    if w.backend != 'python':
+        key = derive(password, salt, w.N, w.r, w.p, w.dkLen, w.backend)[0]
+
+    else:
+        kdf = PBKDF2(password)
+        B = kdf.derive(salt, w.p * 128 * w.r)
+
+        if w.engine == 'python':
+            words = len(B) // 4
+            B = array.array(WORD, struct.unpack('<%dI' % words, B))
+            for i in range(0, w.p):
+                smix(B, i * 32 * w.r, w.r, w.N, w.V, w.XY)
+            B = struct.pack('<%dI' % words, *B)
+        else:
+            B = smix_lanes(B, w.r, w.N, w.engine)
+
+        key = kdf.derive(B, w.dkLen)
+
+    return (key, time.time() - started)
+
+
+def _percentile(values, fraction):
+    'Returns the value at fraction (0.0 to 1.0) of the sorted values.'
+
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class HashPool(object):
+    '''A pool of workers processes which compute scrypt(password, salt, N, r,
+       p, dkLen).
+
+       workers  - the number of worker processes
+       backend  - the key derivation backend (see hash); chosen for the
+                  parameters by default
+       recycle  - replace the workers after each has computed this many
+                  hashes, on average (None to keep them)'''
+
+    def __init__(self, workers, N, r, p, dkLen = 64, backend = None, recycle = None):
+        check_parameters(b'', b'', N)
+
+        self._N = N
+        self._r = r
+        self._p = p
+        self._dkLen = dkLen
+        self._backend = select_backend(N, r, p, dkLen, backend)
+        self._workers = workers
+        self._recycle = recycle
+
+        if recycle is not None and recycle < 1:
+            raise ValueError('recycle must be at least 1')
+
+        # Statistics
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._completed = 0
+        self._failed = 0
+        self._cancelled = 0
+        self._recycled = 0
+        self._latencies = collections.deque(maxlen = LATENCY_SAMPLES)
+        self._service = collections.deque(maxlen = LATENCY_SAMPLES)
+
+        # Recycled executors still finishing their queued hashes, and the
+        # number of unfinished hashes on each executor
+        self._retired = [ ]
+        self._outstanding = { }
+
+        # Start every worker (and allocate its scratchpad) now, rather than
+        # on the first requests
+        (self._executor, ready) = self._start_executor()
+        for future in ready:
+            future.result()
+
+    N = property(lambda s: s._N)
+    r = property(lambda s: s._r)
+    p = property(lambda s: s._p)
+    dkLen = property(lambda s: s._dkLen)
+    backend = property(lambda s: s._backend)
+    workers = property(lambda s: s._workers)
+
+    def _start_executor(self):
+        '''Returns (executor, futures) of a new executor with every worker
+           starting, and futures which complete once they are running.'''
+
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers = self._workers,
+                                                          initializer = _worker_initialize,
+                                                          initargs = (self._N, self._r, self._p, self._dkLen, self._backend))
+        self._submitted = 0
+
+        return (executor, [ executor.submit(_worker_ready) for i in range(0, self._workers) ])
+
+    def _recycle_executor(self):
+        'Replaces the workers once they have been given enough hashes. The lock must be held.'
+
+        if self._recycle is None or self._submitted < self._recycle * self._workers:
+            return
+
+        retired = self._executor
+        (self._executor, ready) = self._start_executor()
+        self._recycled += 1
+
+        # The old workers exit once their queued hashes are complete; only
+        # keep track of them while some are still outstanding
+        retired.shutdown(wait = False)
+        if self._outstanding.get(retired, 0) > 0:
+            self._retired.append(retired)
+
+    def submit(self, password, salt):
+        'Returns a Future for the derived key of password and salt.'
+
+        check_parameters(password, salt, self._N)
+
+        future = concurrent.futures.Future()
+        submitted = time.time()
+
+        def done(work):
+            error = None
+            if not work.cancelled():
+                error = work.exception()
+
+            with self._lock:
+                self._pending -= 1
+
+                # Forget executors (recycled or not) once their last hash is
+                # done; submit counts the current one again from zero
+                self._outstanding[executor] -= 1
+                if self._outstanding[executor] == 0:
+                    del self._outstanding[executor]
+                    if executor in self._retired:
+                        self._retired.remove(executor)
+
+                # A hash already running when its Future was cancelled still
+                # completes, but nobody wants its key
+                if work.cancelled() or future.cancelled():
+                    self._cancelled += 1
+                elif error is not None:
+                    self._failed += 1
+                else:
+                    (key, seconds) = work.result()
+                    self._completed += 1
+                    self._latencies.append(time.time() - submitted)
+                    self._service.append(seconds)
+
+            if work.cancelled():
+                future.cancel()
+            elif future.cancelled():
+                pass
+            elif error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(key)
+
+        with self._lock:
+            self._recycle_executor()
+
+            executor = self._executor
+            work = executor.submit(_worker_hash, password, salt)
+            self._outstanding[executor] = self._outstanding.get(executor, 0) + 1
+            self._submitted += 1
+            self._pending += 1
+
+        work.add_done_callback(done)
+
+        # Cancelling the Future drops the hash, if it has not started yet
+        future.add_done_callback(lambda f: f.cancelled() and work.cancel())
+
+        return future
+
+    def map(self, passwords, salts):
+        'Returns a list of Futures for the derived key of each (password, salt) pair.'
+
+        return [ self.submit(password, salt) for (password, salt) in zip(passwords, salts) ]
+
+    def stats(self):
+        '''Returns a dict of the pool's statistics; the queue depth (pending),
+           completed, failed and cancelled hashes, and latency percentiles (in
+           seconds, from submit to result) over the most recent hashes, along
+           with the mean time spent hashing within the workers.'''
+
+        with self._lock:
+            latencies = sorted(self._latencies)
+            service = list(self._service)
+            stats = dict(workers = self._workers, pending = self._pending,
+                         completed = self._completed, failed = self._failed,
+                         cancelled = self._cancelled,
+                         recycled = self._recycled)
+
+        if latencies:
+            stats.update(latency_p50 = _percentile(latencies, 0.50),
+                         latency_p95 = _percentile(latencies, 0.95),
+                         latency_p99 = _percentile(latencies, 0.99),
+                         latency_max = latencies[-1],
+                         service_mean = sum(service) / len(service))
+
+        return stats
+
+    def shutdown(self, wait = True, cancel_futures = False):
+        '''Stops the workers once the submitted hashes are complete (or, with
+           cancel_futures, drops those that have not started).'''
+
+        with self._lock:
+            executors = self._retired + [ self._executor ]
+
+        for executor in executors:
+            if cancel_futures and sys.version_info >= (3, 9):
+                executor.shutdown(wait = wait, cancel_futures = True)
+            else:
+                executor.shutdown(wait = wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
@@ -0,0 +1,172 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2014 Richard Moore
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+# Memory-mapped scratchpads for ROMix's V (128 * r * N bytes), for very large
+# N on memory-constrained hosts.
+#
+# An anonymous mapping is paged like any other memory; a file-backed mapping
+# (in a given directory) is backed by the page cache instead, so it does not
+# count towards the process's anonymous memory and can be written out under
+# memory pressure. The backing file is unlinked as soon as it is mapped (or,
+# where open files cannot be unlinked, when the scratchpad is closed), and the
+# contents are zeroed before the mapping is released.
+#
+# Pass the scratchpad argument to hash (or smix_lanes):
+#
+#    None           - an in-memory array (the default)
+#    'mmap'         - an anonymous mapping
+#    '/some/path'   - a file-backed mapping in that directory
+
+import mmap
+import os
+
+
+# Bytes zeroed at a time when closing
+ZERO_CHUNK = 1024 * 1024
+
+
+def _madvise(buffer, name):
+    'Applies the named madvise hint, if this Python and platform support it.'
+
+    advice = getattr(mmap, name, None)
+    if advice is None or not hasattr(buffer, 'madvise'):
+        return False
+
+    try:
+        buffer.madvise(advice)
+    except (OSError, ValueError):
+        return False
+
+    return True
+
+
+class Scratchpad(object):
+    '''A zero-filled, memory-mapped buffer of size bytes.
+
+       directory  - directory for a file-backed mapping (None for anonymous)
+       huge_pages - request transparent huge pages (madvise), where supported
+
+       Use as a context manager or call close, which zeros the contents,
+       unmaps them and removes the backing file.'''
+
+    def __init__(self, size, directory = None, huge_pages = True):
+        self._size = size
+        self._directory = directory
+        self._path = None
+        self._views = [ ]
+
+        if directory is None:
+            self._mmap = mmap.mmap(-1, size)
+
+        else:
+            # Only file-backed scratchpads need tempfile (which is slow to import)
+            import tempfile
+
+            (fd, self._path) = tempfile.mkstemp(prefix = 'pyscrypt-', suffix = '.scratch', dir = directory)
+            try:
+                os.ftruncate(fd, size)
+                self._mmap = mmap.mmap(fd, size)
+            except Exception:
+                os.close(fd)
+                os.unlink(self._path)
+                raise
+
+            # The mapping keeps the file alive; remove its name right away
+            # so nothing is left behind if the process dies
+            os.close(fd)
+            if os.name == 'posix':
+                os.unlink(self._path)
+                self._path = None
+
+        # Keep the (secret) contents out of core dumps
+        _madvise(self._mmap, 'MADV_DONTDUMP')
+
+        self._huge_pages = huge_pages and _madvise(self._mmap, 'MADV_HUGEPAGE')
+
+    size = property(lambda s: s._size)
+    directory = property(lambda s: s._directory)
+    huge_pages = property(lambda s: s._huge_pages)
+    closed = property(lambda s: s._mmap is None)
+
+    buffer = property(lambda s: s._mmap)
+
+    def words(self, typecode):
+        '''Returns a memoryview of the scratchpad as words of typecode (e.g.
+           WORD), which is released when the scratchpad is closed.'''
+
+        view = memoryview(self._mmap).cast(typecode)
+        self._views.append(view)
+        return view
+
+    def close(self):
+        'Zeros the contents, then releases the mapping and any backing file.'
+
+        if self._mmap is None:
+            return
+
+        zeros = bytes(bytearray(min(ZERO_CHUNK, self._size)))
+        for offset in range(0, self._size, ZERO_CHUNK):
+            length = min(ZERO_CHUNK, self._size - offset)
+            self._mmap[offset:offset + length] = zeros[:length]
+
+        # Something else (e.g. the traceback of an error raised while it was
+        # in use) may still refer to the mapping; it is already zeroed, and
+        # is unmapped once the last reference goes
+        try:
+            for view in self._views:
+                view.release()
+            self._mmap.close()
+        except BufferError:
+            pass
+        self._views = [ ]
+        self._mmap = None
+
+        if self._path is not None:
+            path = self._path
+            self._path = None
+            os.unlink(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+def open_scratchpad(size, scratchpad, huge_pages = True):
+    '''Returns a Scratchpad of size bytes for a scratchpad argument ('mmap' or
+       a directory; see above).'''
+
+    if scratchpad == 'mmap':
+        return Scratchpad(size, huge_pages = huge_pages)
+
+    if not os.path.isdir(scratchpad):
+        raise ValueError('Scratchpad must be None, \'mmap\' or a directory (got %r)' % (scratchpad, ))
+
+    return Scratchpad(size, directory = scratchpad, huge_pages = huge_pages)
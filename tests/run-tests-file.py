@@ -20,6 +20,59 @@ from pyscrypt import ScryptFile
 
 print("Version: %s" % ".".join(str(p) for p in pyscrypt.VERSION))
 
+# Importing pyscrypt alone must not load the file format (or AES-CTR) until
+# it is used (Python 3.7+)
+if sys.version_info >= (3, 7):
+    import subprocess
+    loaded = subprocess.check_output([ sys.executable, '-c', 'import sys, pyscrypt; print(sorted(m for m in sys.modules if m in ("pyscrypt.file", "pyscrypt.aesctr")))' ])
+    result = {True: "pass", False: "fail"}[loaded.strip() == b'[]']
+    print("Test Lazy import: result=%s" % result)
+
+# AES (FIPS-197 appendix C.3), and the bulk CTR keystream against encrypting
+# each counter block on its own (across a 32-bit carry)
+import binascii
+import struct
+from pyscrypt import aesctr
+key = binascii.unhexlify(b'000102030405060708090a0b0c0d0e0f101112131415161718191a1b1c1d1e1f')
+plaintext = binascii.unhexlify(b'00112233445566778899aabbccddeeff')
+expected = binascii.unhexlify(b'8ea2b7ca516745bfeafc49904b496089')
+aes = aesctr.AES(key)
+ok = (bytes(bytearray(aes.encrypt(bytearray(plaintext)))) == expected and
+      struct.pack('>4I', *aes.encrypt_words(*struct.unpack('>4I', plaintext))) == expected)
+ctr = aesctr.AESCounterModeOfOperation(key)
+ctr._counter = (1 << 32) - 2
+keystream = ctr.keystream(4)
+blocks = [ bytes(bytearray(aes.encrypt(bytearray(struct.pack('>QQ', 0, c))))) for c in range((1 << 32) - 2, (1 << 32) + 2) ]
+ok = ok and bytes(keystream) == b''.join(blocks) and ctr._counter == (1 << 32) + 2
+print("Test AES-CTR keystream: result=%s" % {True: "pass", False: "fail"}[ok])
+
+# The NumPy AES engine must match the pure-Python one, for every key size and
+# across a carry out of the low 64 bits of the counter
+numpy_engine = aesctr._load_numpy_engine()
+if numpy_engine is not None:
+    ok = True
+    numpy_min_blocks = aesctr.NUMPY_MIN_BLOCKS
+    aesctr.NUMPY_MIN_BLOCKS = 1 << 30
+    for key_size in (16, 24, 32):
+        ctr = aesctr.AESCounterModeOfOperation(os.urandom(key_size))
+        for (counter, blocks) in ((0, 100), ((1 << 64) - 50, 100), ((1 << 96) + 7, 3)):
+            ok = ok and numpy_engine.keystream(ctr._aes, counter, blocks) == ctr._generate(counter, blocks)
+    aesctr.NUMPY_MIN_BLOCKS = numpy_min_blocks
+    print("Test AES-CTR numpy: result=%s" % {True: "pass", False: "fail"}[ok])
+
+# Seeking (and keystream_at) must match the keystream generated from the start
+ctr = aesctr.AESCounterModeOfOperation(key)
+stream = bytes(ctr.keystream(40))
+data = os.urandom(len(stream))
+ok = True
+for (offset, length) in ((0, 640), (5, 11), (16, 1), (17, 100), (300, 340), (639, 1)):
+    ok = ok and bytes(ctr.keystream_at(offset, length)) == stream[offset:offset + length]
+    ctr.seek(offset)
+    ok = ok and ctr.tell() == offset
+    ok = ok and ctr.encrypt(data[offset:offset + length]) == aesctr.xor_bytes(data[offset:offset + length], stream[offset:])
+    ok = ok and ctr.tell() == offset + length
+print("Test AES-CTR seek: result=%s" % {True: "pass", False: "fail"}[ok])
+
 # Test decrypted output is equal to the input
 for text_length in [3, 16, 127, 128, 129, 1500]:
     plaintext = os.urandom(text_length)
@@ -43,6 +96,74 @@ for text_length in [3, 16, 127, 128, 129, 1500]:
     print("Test Encrypt/Decrypt: text_length=%s result=%s valid=%s" % (text_length, result, sf.valid))
 
 
+# Writing in pieces must produce the same file as one write (successive writes
+# must continue the keystream, not reuse it), and any read size must
+# decrypt it all
+plaintext = os.urandom(3000) + b"\nsecond line\nlast line"
+salt = os.urandom(32)
+files = [ ]
+for piece in (len(plaintext), 7, 16, 1000):
+    fp = StringIO()
+    sf = ScryptFile(fp = fp, password = b"password", N = 16, r = 1, p = 1, salt = salt, mode = ScryptFile.MODE_WRITE)
+    for offset in range(0, len(plaintext), piece):
+        sf.write(plaintext[offset:offset + piece])
+    sf.finalize()
+    files.append(fp.getvalue())
+result = {True: "pass", False: "fail"}[all(f == files[0] for f in files)]
+print("Test Write pieces: result=%s" % result)
+
+for size in (1, 5, 16, 1005):
+    sf = ScryptFile(fp = StringIO(files[0]), password = b"password", mode = ScryptFile.MODE_READ)
+    pieces = [ ]
+    while True:
+        piece = sf.read(size)
+        if not piece: break
+        pieces.append(piece)
+    result = {True: "pass", False: "fail"}[b''.join(pieces) == plaintext and sf.valid]
+    print("Test Read pieces: size=%d result=%s" % (size, result))
+
+sf = ScryptFile(fp = StringIO(files[0]), password = b"password", mode = ScryptFile.MODE_READ)
+lines = sf.readlines()
+result = {True: "pass", False: "fail"}[b''.join(lines) == plaintext and lines[-1] == b"last line" and sf.valid]
+print("Test Readlines: result=%s" % result)
+
+# The file I/O reported to instrumentation must add up to the file, however
+# the reads are split
+import pyscrypt.instrument
+stats = pyscrypt.instrument.Stats()
+pyscrypt.instrument.add_hook(stats)
+sf = ScryptFile(fp = StringIO(files[0]), password = b"password", mode = ScryptFile.MODE_READ)
+decrypted = sf.read(5) + sf.read(1005) + sf.read()
+pyscrypt.instrument.remove_hook(stats)
+result = {True: "pass", False: "fail"}[decrypted == plaintext and stats.snapshot()['file.io.read']['bytes'] == len(files[0])]
+print("Test Instrumented reads: result=%s" % result)
+
+
+# Files written by one key derivation backend must be readable by another
+backends = pyscrypt.available_backends()
+for (write_backend, read_backend) in zip(backends, reversed(backends)):
+    fp = StringIO()
+    sf = ScryptFile(fp = fp, password = b"password", N = 1024, r = 1, p = 1, mode = ScryptFile.MODE_WRITE, backend = write_backend)
+    sf.write(b"Hello world")
+    sf.finalize()
+
+    fp = StringIO(fp.getvalue())
+    sf = ScryptFile(fp = fp, password = b"password", mode = ScryptFile.MODE_READ, backend = read_backend)
+    result = {True: "pass", False: "fail"}[sf.read() == b"Hello world" and sf.backend == read_backend]
+    print("Test Backend: write=%s read=%s result=%s" % (write_backend, read_backend, result))
+
+
+# A file must still decrypt when the scratchpad is limited below 128 * r * N
+fp = StringIO()
+sf = ScryptFile(fp = fp, password = b"password", N = 1024, r = 1, p = 1, mode = ScryptFile.MODE_WRITE)
+sf.write(b"Hello world")
+sf.finalize()
+fp = StringIO(fp.getvalue())
+sf = ScryptFile(fp = fp, password = b"password", mode = ScryptFile.MODE_READ, max_memory = 128 * 1024 // 8)
+result = {True: "pass", False: "fail"}[sf.read() == b"Hello world" and sf.backend == 'python']
+print("Test max_memory: result=%s" % result)
+
+
 # Generate some files to make sure the tarsnap scrypt utility can read them
 for length in (10, 100, 1000):
     path_scrypt = '/tmp/test-%d.scrypt' % length
@@ -71,7 +192,7 @@ for filename in ('test1', 'test2'):
     result = {True: "pass", False: "fail"}[valid]
     print("Test Verify: filename=%s result=%s" % (path_scrypt, result))
 
-    for test in (0, 1, 2):
+    for test in (0, 1, 2, 3):
         sf = ScryptFile(file(path_scrypt, ScryptFile.MODE_READ), b'password')
         f = file(path_text, ScryptFile.MODE_READ)
 
@@ -90,6 +211,31 @@ for filename in ('test1', 'test2'):
             content_scrypt = sf.read()
             content_text = f.read()
 
+        # Test reading it all, a little at a time
+        elif test == 3:
+            content_scrypt = b''.join(iter(lambda: sf.read(37), b''))
+            content_text = f.read()
+
         result = {True: "pass", False: "fail"}[content_scrypt == content_text]
         print("Test Decrypt: dec(%r) == %r result=%s valid=%s" % (path_scrypt, path_text, result, sf.valid))
 
+
+# Parallel AES-CTR must produce the same file as the serial engine, and read
+# it back (guarded, as worker processes may re-import this script)
+if __name__ == '__main__' and sys.version_info >= (3, 8):
+    aesctr.PARALLEL_MIN_BYTES = 4096
+    plaintext = os.urandom(3 * 4096 + 5)
+    salt = os.urandom(32)
+    files = [ ]
+    for workers in (None, 3):
+        fp = StringIO()
+        sf = ScryptFile(fp = fp, password = b"password", N = 16, r = 1, p = 1, salt = salt, mode = ScryptFile.MODE_WRITE, workers = workers)
+        sf.write(plaintext[:7])
+        sf.write(plaintext[7:])
+        sf.finalize()
+        files.append(fp.getvalue())
+
+    sf = ScryptFile(fp = StringIO(files[1]), password = b"password", mode = ScryptFile.MODE_READ, workers = 3)
+    decrypted = sf.read(5) + sf.read()
+    result = {True: "pass", False: "fail"}[files[0] == files[1] and decrypted == plaintext and sf.valid]
+    print("Test Parallel AES-CTR: result=%s" % result)
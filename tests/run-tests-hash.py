@@ -58,7 +58,7 @@ if False:
         print(hexlify(scrypt.hash(**test)))
         print()
 
-# Run each test case
+# Run each test case (with each available backend and ROMix engine)
 index = 0
 for test in Tests:
     index += 1
@@ -67,8 +67,393 @@ for test in Tests:
     result = test['result']
     del test['result']
 
-    # Perform the hash
-    h = hexlify(pyscrypt.hash(**test))
+    for backend in pyscrypt.available_backends():
 
-    # How'd we do?
-    print("Test %d: %s" % (index, { True: "pass", False: "FAIL" }[h == result]))
+        # Perform the hash
+        (h, used) = pyscrypt.derive(backend = backend, **test)
+        h = hexlify(h)
+
+        # How'd we do?
+        print("Test %d (backend=%s): %s" % (index, backend, { True: "pass", False: "FAIL" }[h == result and used == backend]))
+
+    for engine in pyscrypt.available_engines():
+
+        # Perform the hash
+        h = hexlify(pyscrypt.hash(engine = engine, **test))
+
+        # How'd we do?
+        print("Test %d (engine=%s): %s" % (index, engine, { True: "pass", False: "FAIL" }[h == result]))
+
+# The hashlib backend must be given enough maxmem for a large N * r (the
+# hashlib default of 32MB is exceeded by this 128MB scratchpad)
+if 'hashlib' in pyscrypt.available_backends():
+    try:
+        (h, used) = pyscrypt.derive(b'password', b'salt', N = 1 << 17, r = 8, p = 1, dkLen = 16, backend = 'hashlib')
+        print("Test hashlib maxmem: %s" % { True: "pass", False: "FAIL" }[used == 'hashlib' and len(h) == 16])
+    except ValueError as e:
+        print("Test hashlib maxmem: FAIL (%s)" % e)
+
+# Calibration against synthetic measurements of 1 microsecond per N * r * p
+points = [ (N, 8, 1, N * 8 * 0.000001) for N in (16, 32, 64, 128) ]
+for (target, memory, expected) in ((1.0, 1 << 30, (65536, 8, 1)), (1.0, 1 << 20, (512, 8, 244))):
+    params = pyscrypt.calibrate(target, memory, r = 8, points = points)
+    print("Test calibrate (target=%s, memory=%d): %s" % (target, memory, { True: "pass", False: "FAIL" }[params == expected]))
+
+# Derived key cache; hits, LRU eviction (zeroing the evicted key) and expiry
+cache = pyscrypt.DerivedKeyCache(max_bytes = 64, ttl = 60)
+key = pyscrypt.hash(b'password', b'salt', 16, 1, 1, 32, cache = cache)
+(cached, used) = pyscrypt.derive(b'password', b'salt', 16, 1, 1, 32, cache = cache)
+print("Test cache hit: %s" % { True: "pass", False: "FAIL" }[cached == key and used == 'cache' and (cache.hits, cache.misses) == (1, 1)])
+
+stored = list(cache._entries.values())[0][0]
+pyscrypt.hash(b'password2', b'salt', 16, 1, 1, 32, cache = cache)
+pyscrypt.hash(b'password3', b'salt', 16, 1, 1, 32, cache = cache)
+evicted = (cache.get(b'password', b'salt', 16, 1, 1, 32) is None and stored == bytearray(32))
+print("Test cache eviction: %s" % { True: "pass", False: "FAIL" }[evicted and len(cache) == 2 and cache.size == 64])
+
+cache = pyscrypt.DerivedKeyCache(ttl = 0)
+pyscrypt.hash(b'password', b'salt', 16, 1, 1, 32, cache = cache)
+print("Test cache ttl: %s" % { True: "pass", False: "FAIL" }[cache.get(b'password', b'salt', 16, 1, 1, 32) is None and len(cache) == 0])
+
+# Step-wise hashing; the result must not depend on the step size
+test = dict(password = b'password', salt = b'salt', N = 128, r = 3, p = 3, dkLen = 45)
+expected = hexlify(pyscrypt.hash(**test))
+for iterations in (1, 7, 128, 10000):
+    reported = [ ]
+    hasher = pyscrypt.ScryptHasher(callback = reported.append, **test)
+    progress = list(hasher.steps(iterations))
+    h = hexlify(hasher.digest())
+    ok = (h == expected and progress[-1] == 1.0 and reported == sorted(reported) and hasher.completed == hasher.total == 2 * 128 * 3)
+    print("Test ScryptHasher (iterations=%d): %s" % (iterations, { True: "pass", False: "FAIL" }[ok]))
+
+hasher = pyscrypt.ScryptHasher(**test)
+hasher.step(10)
+hasher.cancel()
+try:
+    hasher.step(10)
+    print("Test ScryptHasher cancel: FAIL")
+except pyscrypt.ScryptCancelled:
+    print("Test ScryptHasher cancel: pass")
+
+# Batched hashing must match hashing each password on its own
+passwords = [ b'password', b'', b'correct horse battery staple', b'password' ]
+salts = [ b'salt', b'salt', b'seasalt', b'pepper' ]
+for engine in [ None ] + pyscrypt.available_engines():
+    for max_memory in (1, 1 << 30, None):
+        results = pyscrypt.hash_many(passwords, salts, N = 16, r = 2, p = 3, dkLen = 48, engine = engine, max_memory = max_memory)
+        expected = [ pyscrypt.hash(pw, s, N = 16, r = 2, p = 3, dkLen = 48, engine = 'python') for (pw, s) in zip(passwords, salts) ]
+        print("Test hash_many (engine=%s, max_memory=%s): %s" % (engine, max_memory, { True: "pass", False: "FAIL" }[results == expected]))
+
+hash_module = sys.modules['pyscrypt.hash']
+
+# The swar engine keeps V as big ints (several times the memory), so is only
+# used when asked for; a few lanes default to the compact pure-Python engine,
+# and a few more to numpy (if it is installed)
+ok = hash_module.select_engine(1) == 'python' and hash_module.select_engine(2) == 'python'
+ok = ok and hash_module.NUMPY_MIN_LANES <= 16
+if 'numpy' in pyscrypt.available_engines():
+    ok = ok and hash_module.select_engine(16) == 'numpy' and hash_module.select_engine(hash_module.NUMPY_MIN_LANES) == 'numpy'
+print("Test default engine: %s" % { True: "pass", False: "FAIL" }[ok])
+
+# The time-memory tradeoff keeps only every k-th block of V; the key must not
+# change, whatever k is (including k that do not divide N)
+ok = True
+for (N, r, p, max_memory) in ((64, 1, 1, 128 * 32), (64, 1, 2, 128 * 5), (32, 2, 1, 256), (16, 3, 2, 384 * 3)):
+    expected = pyscrypt.hash(b'password', b'salt', N, r, p, 32, engine = 'python')
+    ok = ok and pyscrypt.hash(b'password', b'salt', N, r, p, 32, max_memory = max_memory) == expected
+    ok = ok and hash_module.tmto_interval(N, r, max_memory) > 1
+try:
+    pyscrypt.hash(b'password', b'salt', 64, 1, 2, 32, engine = 'swar', max_memory = 1024)
+    ok = False
+except ValueError:
+    pass
+
+# The swar engine's big-int V is several times the compact size, so it must
+# not be used (or, if asked for, must refuse) where only that size fits
+try:
+    pyscrypt.hash(b'password', b'salt', 64, 1, 2, 32, engine = 'swar', max_memory = 128 * 64 * 2)
+    ok = False
+except ValueError:
+    pass
+ok = ok and hash_module.engine_memory('swar', 2, 1, 64) > hash_module.engine_memory('numpy', 2, 1, 64)
+
+# hash_many batches by the engine's real footprint, not the compact size
+size = hash_module._batch_size('swar', 16, 8, 1024, 1, 16 * 128 * 8 * 1024)
+ok = ok and size < 16 and hash_module.engine_memory('swar', size, 8, 1024) <= 16 * 128 * 8 * 1024
+ok = ok and hash_module._batch_size('numpy', 16, 8, 1024, 2, 5 * 128 * 8 * 1024) == 2
+ok = ok and hash_module._batch_size('swar', 16, 8, 1024, 1, None) == 16
+print("Test max_memory: %s" % { True: "pass", False: "FAIL" }[ok])
+
+# A mid-size hash_many batch runs its lanes together on the multi-lane
+# engine by default (when NumPy is installed)
+if 'numpy' in pyscrypt.available_engines():
+    engines = [ ]
+    original = hash_module.smix_lanes
+    def recording(data, r, N, engine = 'python', *args):
+        engines.append(engine)
+        return original(data, r, N, engine, *args)
+    hash_module.smix_lanes = recording
+    many = [ b'password%d' % i for i in range(0, 16) ]
+    results = pyscrypt.hash_many(many, [ b'salt' ] * len(many), N = 16, r = 1, p = 1, dkLen = 32, backend = 'python')
+    hash_module.smix_lanes = original
+    expected = [ pyscrypt.hash(pw, b'salt', N = 16, r = 1, p = 1, dkLen = 32, engine = 'python') for pw in many ]
+    print("Test hash_many default engine: %s" % { True: "pass", False: "FAIL" }[engines == [ 'numpy' ] and results == expected])
+
+# Nonce scanning must find exactly the nonces whose scrypt(header, header,
+# 1024, 1, 1, 32) hash (as a little-endian integer) is within the target
+import struct
+from pyscrypt.mining import hash_to_int
+header76 = bytes(bytearray(range(76)))
+hashes = [ ]
+for nonce in range(7, 12):
+    header = header76 + struct.pack('<I', nonce)
+    hashes.append(hash_to_int(pyscrypt.hash(header, header, N = 1024, r = 1, p = 1, dkLen = 32, engine = 'python')))
+target = sorted(hashes)[1]
+expected = [ n for (n, h) in zip(range(7, 12), hashes) if h <= target ]
+for engine in pyscrypt.available_engines():
+    (found, stats) = pyscrypt.scan_nonces(header76, 7, 5, target, engine = engine, batch = 3)
+    print("Test scan_nonces (engine=%s): %s" % (engine, { True: "pass", False: "FAIL" }[found == expected and stats['hashes'] == 5]))
+
+# The default batch runs its nonces together on the numpy engine (if installed)
+if 'numpy' in pyscrypt.available_engines():
+    from pyscrypt.mining import SCAN_BATCH
+    print("Test scan_nonces default engine: %s" % { True: "pass", False: "FAIL" }[hash_module.select_engine(SCAN_BATCH) == 'numpy'])
+
+# The keyed PBKDF2 engine (with and without hashlib.pbkdf2_hmac) must match
+# the generic per-block HMAC construction
+generic_prf = lambda key, message: hash_module.prf(key, message)
+pbkdf2_hmac = hash_module._pbkdf2_hmac
+for native in (pbkdf2_hmac, None):
+    hash_module._pbkdf2_hmac = native
+    ok = True
+    for (password, salt, length) in ((b'password', b'salt', 64), (b'', b'', 1), (b'p' * 100, b'NaCl', 1000)):
+        expected = hash_module.pbkdf2_single(password, salt, length, generic_prf)
+        kdf = hash_module.PBKDF2(password)
+        output = bytearray(length)
+        kdf.derive_into(salt, output)
+        ok = ok and kdf.derive(salt, length) == expected and bytes(output) == expected
+    print("Test PBKDF2 (native=%s): %s" % (native is not None, { True: "pass", False: "FAIL" }[ok]))
+hash_module._pbkdf2_hmac = pbkdf2_hmac
+
+# The buffer arena reuses (zeroed) buffers between hashes, up to its limit
+arena = sys.modules['pyscrypt.arena']
+pyscrypt.set_arena(3 * 4 * (32 * 2 * 32 + 64 * 2) // 2)
+test = dict(password = b'password', salt = b'salt', N = 32, r = 2, p = 2, dkLen = 32)
+h = pyscrypt.hash(engine = 'python', **test)
+retained = arena.retained_bytes()
+(V, XY) = arena.acquire(32, 2, hash_module.WORD)
+arena.give_back(32, 2, V, XY)
+ok = (h == pyscrypt.hash(engine = 'python', **test) and retained == 4 * (32 * 2 * 32 + 64 * 2) and
+      arena.acquire(32, 2, hash_module.WORD)[0] is V and not any(V))
+
+# Over the limit, the least recently used buffers are released
+arena.give_back(32, 2, V, XY)
+pyscrypt.hash(b'password', b'salt', N = 16, r = 2, p = 1, dkLen = 32, engine = 'python')
+pyscrypt.hash(b'password', b'salt', N = 32, r = 2, p = 1, dkLen = 32, engine = 'python')
+ok = ok and list(arena._thread_arena().buffers) == [ (32, 2, hash_module.WORD) ] and arena.retained_bytes() == retained
+pyscrypt.release_buffers()
+ok = ok and arena.retained_bytes() == 0
+pyscrypt.set_arena(None)
+print("Test buffer arena: %s" % { True: "pass", False: "FAIL" }[ok])
+
+# Instrumentation hooks see every phase of a pure-Python hash
+import pyscrypt.instrument
+stats = pyscrypt.instrument.Stats()
+pyscrypt.instrument.add_hook(stats)
+pyscrypt.hash(b'password', b'salt', N = 16, r = 1, p = 2, dkLen = 32, engine = 'python')
+pyscrypt.instrument.remove_hook(stats)
+phases = stats.snapshot()
+ok = (sorted(phases) == [ 'hash.pbkdf2', 'hash.pbkdf2.final', 'hash.romix.fill', 'hash.romix.mix' ] and
+      phases['hash.romix.mix']['count'] == 2 and phases['hash.romix.mix']['blocks'] == 32 and
+      not pyscrypt.instrument.enabled)
+print("Test instrumentation: %s" % { True: "pass", False: "FAIL" }[ok])
+
+# Memory-mapped scratchpads must not change the result, and must leave
+# nothing behind in their directory
+if sys.version_info[0] >= 3:
+    import os
+    import shutil
+    import tempfile
+
+    test = dict(password = b'password', salt = b'salt', N = 64, r = 2, p = 2, dkLen = 64)
+    expected = pyscrypt.hash(**test)
+
+    directory = tempfile.mkdtemp()
+    for engine in [ e for e in pyscrypt.available_engines() if e != 'swar' ]:
+        for scratchpad in ('mmap', directory):
+            h = pyscrypt.hash(engine = engine, scratchpad = scratchpad, **test)
+            print("Test scratchpad (engine=%s, %s): %s" % (engine, { True: "file", False: "mmap" }[scratchpad == directory], { True: "pass", False: "FAIL" }[h == expected]))
+    print("Test scratchpad cleanup: %s" % { True: "pass", False: "FAIL" }[os.listdir(directory) == [ ]])
+
+    # An error during SMix must propagate (not a BufferError from closing
+    # the mapping while the traceback still refers to it), and still leave
+    # nothing behind
+    class Interrupted(Exception):
+        pass
+
+    def interrupted(*args):
+        raise Interrupted()
+
+    ok = True
+    for engine in [ e for e in pyscrypt.available_engines() if e != 'swar' ]:
+        module = sys.modules[{ True: 'pyscrypt.hash_numpy', False: 'pyscrypt.hash' }[engine == 'numpy']]
+        original = module.blockmix_salsa8
+        module.blockmix_salsa8 = interrupted
+        for scratchpad in ('mmap', directory):
+            try:
+                pyscrypt.hash(engine = engine, scratchpad = scratchpad, **test)
+                ok = False
+            except Interrupted:
+                pass
+            except Exception:
+                ok = False
+        module.blockmix_salsa8 = original
+    ok = ok and os.listdir(directory) == [ ] and pyscrypt.hash(engine = 'python', scratchpad = directory, **test) == expected
+    print("Test scratchpad error: %s" % { True: "pass", False: "FAIL" }[ok])
+    shutil.rmtree(directory)
+
+    try:
+        pyscrypt.hash(scratchpad = '/no/such/directory', **test)
+        print("Test scratchpad invalid: FAIL")
+    except ValueError:
+        print("Test scratchpad invalid: pass")
+
+# SMix works in place on preallocated buffers, so its peak allocation while
+# running must not grow with r (a single r = 32 block alone is 4096 bytes)
+try:
+    import array
+    import tracemalloc
+
+    hash_module = sys.modules['pyscrypt.hash']
+    for r in (1, 8, 32):
+        N = 16
+        B = array.array(hash_module.WORD, range(32 * r))
+        XY = array.array(hash_module.WORD, [ 0 ]) * (64 * r)
+        V = array.array(hash_module.WORD, [ 0 ]) * (32 * r * N)
+
+        # Warm up first (the interpreter may allocate caches while it
+        # specializes the first few calls)
+        for i in range(0, 4):
+            hash_module.smix(B, 0, r, N, V, XY)
+
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        hash_module.smix(B, 0, r, N, V, XY)
+        peak = tracemalloc.get_traced_memory()[1] - before
+        tracemalloc.stop()
+
+        print("Test smix allocations (r=%d, peak=%d bytes): %s" % (r, peak, { True: "pass", False: "FAIL" }[peak < 4096]))
+
+except ImportError:
+    pass
+
+# Running the SMix lanes in parallel must not change the result
+if __name__ == '__main__':
+    import concurrent.futures
+
+    test = dict(password = b'password', salt = b'salt', N = 32, r = 4, p = 15, dkLen = 128)
+    expected = hexlify(pyscrypt.hash(**test))
+
+    for workers in (2, 4):
+        h = hexlify(pyscrypt.hash(workers = workers, **test))
+        print("Test workers=%d: %s" % (workers, { True: "pass", False: "FAIL" }[h == expected]))
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers = 3)
+    pyscrypt.set_executor(executor)
+    h = hexlify(pyscrypt.hash(workers = 3, **test))
+    pyscrypt.set_executor(None)
+    executor.shutdown()
+    print("Test set_executor: %s" % { True: "pass", False: "FAIL" }[h == expected])
+
+    # A HashPool (recycling its workers) must match hash
+    from pyscrypt.pool import HashPool
+
+    passwords = [ b'password%d' % i for i in range(0, 6) ]
+    expected = [ pyscrypt.hash(pw, b'salt', N = 16, r = 2, p = 2, dkLen = 32) for pw in passwords ]
+    for backend in pyscrypt.available_backends():
+        with HashPool(2, N = 16, r = 2, p = 2, dkLen = 32, backend = backend, recycle = 2) as pool:
+            keys = [ f.result() for f in pool.map(passwords, [ b'salt' ] * len(passwords)) ]
+            stats = pool.stats()
+        ok = keys == expected and stats['completed'] == len(passwords) and stats['pending'] == 0 and stats['recycled'] >= 1
+        print("Test HashPool (backend=%s): %s" % (backend, { True: "pass", False: "FAIL" }[ok]))
+
+    # Recycling between hashes (nothing outstanding) must not keep the old
+    # executors around
+    with HashPool(1, N = 16, r = 2, p = 2, dkLen = 32, recycle = 1) as pool:
+        keys = [ pool.submit(pw, b'salt').result() for pw in passwords ]
+        ok = (keys == expected and pool.stats()['recycled'] >= 4 and pool._retired == [ ] and
+              pool._outstanding == { })
+    print("Test HashPool recycle: %s" % { True: "pass", False: "FAIL" }[ok])
+
+    # Cancelled Futures are counted as cancelled (whether or not their hash
+    # had already started), never as completed
+    with HashPool(1, N = 1024, r = 1, p = 1, dkLen = 32) as pool:
+        futures = pool.map(passwords[:4], [ b'salt' ] * 4)
+        cancelled = [ f.cancel() for f in futures[1:] ]
+        futures[0].result()
+    stats = pool.stats()
+    ok = all(cancelled) and (stats['completed'], stats['cancelled'], stats['failed'], stats['pending']) == (1, 3, 0, 0)
+    print("Test HashPool cancel: %s" % { True: "pass", False: "FAIL" }[ok])
+
+# The asyncio API (Python 3.7+)
+try:
+    import asyncio
+    import pyscrypt.aio
+    has_aio = hasattr(asyncio, 'run')
+except (ImportError, SyntaxError):
+    has_aio = False
+
+if has_aio:
+    from io import BytesIO
+
+    test = dict(password = b'password', salt = b'salt', N = 16, r = 1, p = 1, dkLen = 64)
+    expected = pyscrypt.hash(**test)
+
+    async def run_aio():
+        limiter = pyscrypt.aio.Limiter(max_concurrency = 1, max_queue = 2)
+
+        # One running, two waiting; the fourth is turned away
+        tasks = [ asyncio.ensure_future(pyscrypt.aio.hash(limiter = limiter, **test)) for i in range(0, 4) ]
+        results = await asyncio.gather(*tasks, return_exceptions = True)
+        overloaded = [ isinstance(r, pyscrypt.aio.ScryptOverloaded) for r in results ]
+        print("Test aio hash: %s" % { True: "pass", False: "FAIL" }[results[:3] == [ expected ] * 3])
+        print("Test aio overloaded: %s" % { True: "pass", False: "FAIL" }[overloaded == [ False, False, False, True ]])
+
+        # Cancelled callers (e.g. timed out) keep their turn until the work
+        # they started is done, so the limit still holds
+        import concurrent.futures
+        import threading
+        import time
+
+        lock = threading.Lock()
+        counts = dict(running = 0, most = 0)
+        def slow():
+            with lock:
+                counts['running'] += 1
+                counts['most'] = max(counts['most'], counts['running'])
+            time.sleep(0.05)
+            with lock:
+                counts['running'] -= 1
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers = 4)
+        limiter = pyscrypt.aio.Limiter(max_concurrency = 1, max_queue = None, executor = executor)
+        for i in range(0, 4):
+            try:
+                await asyncio.wait_for(limiter.run(slow), 0.01)
+            except asyncio.TimeoutError:
+                pass
+        while limiter.running or limiter.waiting:
+            await asyncio.sleep(0.01)
+        executor.shutdown()
+        print("Test aio cancel: %s" % { True: "pass", False: "FAIL" }[counts['most'] == 1])
+
+        # Write and read back a ScryptFile with the keys derived off the loop
+        fp = BytesIO()
+        sf = await pyscrypt.aio.open_file(fp, b'password', N = 16, r = 1, p = 1, mode = 'wb')
+        sf.write(b'hello world')
+        sf.finalize()
+
+        sf = await pyscrypt.aio.open_file(BytesIO(fp.getvalue()), b'password', mode = 'rb')
+        print("Test aio open_file: %s" % { True: "pass", False: "FAIL" }[sf.read() == b'hello world' and sf.valid])
+
+    asyncio.run(run_aio())
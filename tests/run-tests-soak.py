@@ -0,0 +1,90 @@
+import sys
+sys.path += '..'
+
+# Streams a large ScryptFile through write and read in chunks, checking the
+# RSS stays flat (the AES-CTR keystream must not grow with the file).
+#
+#   python tests/run-tests-soak.py [size, e.g. 16M or 4G] [path]
+
+import hashlib
+import os
+import tempfile
+
+import pyscrypt
+from pyscrypt import ScryptFile
+
+print("Version: %s" % ".".join(str(p) for p in pyscrypt.VERSION))
+
+# Bytes per write and read
+CHUNK = 64 * 1024
+
+# The RSS may grow by at most this much once the first quarter has streamed
+MAX_GROWTH = 4 * 1024 * 1024
+
+
+def parse_size(size):
+    units = dict(K = 1024, M = 1024 * 1024, G = 1024 * 1024 * 1024)
+    size = size.strip().upper()
+    if size[-1:] in units:
+        return int(size[:-1]) * units[size[-1]]
+    return int(size)
+
+
+def rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        return None
+
+
+size = parse_size(sys.argv[1] if len(sys.argv) > 1 else '1M')
+if len(sys.argv) > 2:
+    path = sys.argv[2]
+else:
+    (fd, path) = tempfile.mkstemp(prefix = 'pyscrypt-soak-', suffix = '.scrypt')
+    os.close(fd)
+
+chunk = os.urandom(CHUNK)
+
+def stream(function):
+    'Calls function for each chunk, returning (settled RSS, maximum RSS after it).'
+
+    settled = None
+    peak = 0
+    for offset in range(0, size, CHUNK):
+        function(offset)
+        if offset >= size // 4:
+            current = rss()
+            if current is None: continue
+            if settled is None: settled = current
+            peak = max(peak, current)
+    return (settled, peak)
+
+try:
+    expected = hashlib.sha256()
+    with ScryptFile(path, b'password', N = 16, r = 1, p = 1) as sf:
+        def write(offset):
+            data = chunk[:min(CHUNK, size - offset)]
+            expected.update(data)
+            sf.write(data)
+        (write_settled, write_peak) = stream(write)
+
+    actual = hashlib.sha256()
+    with ScryptFile(path, b'password') as sf:
+        def read(offset):
+            actual.update(sf.read(CHUNK))
+        (read_settled, read_peak) = stream(read)
+        valid = sf.read(1) == b'' and sf.valid
+
+    ok = valid and actual.digest() == expected.digest()
+    flat = None
+    if write_settled is not None and read_settled is not None:
+        flat = (write_peak - write_settled <= MAX_GROWTH and read_peak - read_settled <= MAX_GROWTH)
+        print("RSS growth: write=%d KiB read=%d KiB" % ((write_peak - write_settled) // 1024, (read_peak - read_settled) // 1024))
+
+    print("Test Soak: size=%d result=%s rss_flat=%s" % (size, {True: "pass", False: "fail"}[ok and flat is not False], flat))
+
+finally:
+    if len(sys.argv) <= 2:
+        os.unlink(path)